@@ -5,3 +5,8 @@ class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
     verbose_name = 'foodgram api'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .utils import register_fonts
+        register_fonts()
@@ -0,0 +1,59 @@
+from hashlib import sha256
+
+from django.conf import settings
+from django.db import router
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from users.models import User
+
+from .cache import CacheNamespace
+
+token_cache = CacheNamespace('auth', timeout=settings.TOKEN_CACHE_TIMEOUT)
+
+CACHED_USER_FIELDS = [
+    field.attname for field in User._meta.concrete_fields
+    if field.attname in (
+        'id', 'is_superuser', 'username', 'first_name', 'last_name',
+        'email', 'is_staff', 'is_active',
+    )
+]
+
+
+def get_token_cache_key(key):
+    '''Ключ кэша по хэшу токена, сам токен в кэш не попадает.'''
+    return sha256(key.encode()).hexdigest()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''
+    Аутентификация по токену с соответствием токена пользователю
+    в общем кэше Django.
+    В кэше хранятся только поля пользователя из CACHED_USER_FIELDS,
+    без хэша пароля; остальные поля загружаются из базы при обращении.
+    Записи живут TOKEN_CACHE_TIMEOUT секунд и удаляются при выходе,
+    смене пароля, изменении и удалении пользователя.
+    Изменения через QuerySet.update(), например is_active=False,
+    сигналов не отправляют и вступают в силу по истечении TTL.
+    '''
+
+    def authenticate_credentials(self, key):
+        cache_key = get_token_cache_key(key)
+        values = token_cache.get(cache_key)
+        if values is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(cache_key, [
+                getattr(user, name) for name in CACHED_USER_FIELDS
+            ])
+            return user, token
+        user = User.from_db(
+            router.db_for_read(User), CACHED_USER_FIELDS, values
+        )
+        token = Token.from_db(
+            router.db_for_read(Token), ['key', 'user_id'], [key, user.id]
+        )
+        token.user = user
+        return user, token
+
+
+def invalidate_token(key):
+    token_cache.delete(get_token_cache_key(key))
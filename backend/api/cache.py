@@ -0,0 +1,238 @@
+from collections import OrderedDict
+from contextvars import ContextVar
+from threading import Lock
+from time import monotonic, time_ns
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import transaction
+from recipes.models import DataVersion
+
+INGREDIENTS_VERSION = 'ingredients'
+TAGS_VERSION = 'tags'
+RECIPES_VERSION = 'recipes'
+COUNTS_VERSION = 'counts'
+
+# Справочники меняются и из других процессов (manage.py import_data),
+# до которых кэш в памяти процесса не доходит, поэтому их версии
+# хранятся в базе данных.
+STORED_VERSIONS = frozenset((INGREDIENTS_VERSION, TAGS_VERSION))
+
+# Версии из базы данных, прочитанные процессом: имя -> (версия, срок).
+local_versions = {}
+
+# Попадания и промахи текущего запроса по пространствам имен,
+# собираются api.instrumentation.
+cache_counters = ContextVar('cache_counters', default=None)
+
+
+class LRUCache:
+    '''
+    Кэш процесса с вытеснением давно не использованных записей.
+    Размер ограничен суммой размеров значений, размер считает get_size.
+    '''
+
+    def __init__(self, max_size, get_size=len):
+        self.max_size = max_size
+        self.get_size = get_size
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def _pop(self, key):
+        self.size -= self.get_size(self._data.pop(key))
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        size = self.get_size(value)
+        if size > self.max_size:
+            return
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = value
+            self.size += size
+            while self.size > self.max_size:
+                self._pop(next(iter(self._data)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+class CacheNamespace:
+    '''
+    Пространство имен подсистемы в общем кэше Django.
+    Ключи получают префикс name, чтобы подсистемы не пересекались.
+    Попадания и промахи считаются в cache_counters текущего запроса.
+    '''
+
+    def __init__(self, name, timeout=DEFAULT_TIMEOUT,
+                 alias=DEFAULT_CACHE_ALIAS):
+        self.name = name
+        self.timeout = timeout
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def make_key(self, key):
+        return f'{self.name}:{key}'
+
+    def count(self, hit):
+        counters = cache_counters.get()
+        if counters is None:
+            return
+        stats = counters.setdefault(self.name, {'hits': 0, 'misses': 0})
+        stats['hits' if hit else 'misses'] += 1
+
+    def get(self, key, default=None):
+        value = self.cache.get(self.make_key(key))
+        self.count(value is not None)
+        return default if value is None else value
+
+    def get_many(self, keys):
+        found = self.cache.get_many([self.make_key(key) for key in keys])
+        values = {}
+        for key in keys:
+            value = found.get(self.make_key(key))
+            self.count(value is not None)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.timeout
+        self.cache.set(self.make_key(key), value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.timeout
+        return self.cache.add(self.make_key(key), value, timeout)
+
+    def delete(self, key):
+        self.cache.delete(self.make_key(key))
+
+    def delete_many(self, keys):
+        self.cache.delete_many([self.make_key(key) for key in keys])
+
+
+versions = CacheNamespace('version', timeout=None)
+
+
+def get_cached_version(name):
+    version = versions.get(name)
+    if version is None:
+        versions.add(name, time_ns())
+        version = versions.get(name)
+    return version
+
+
+def remember_version(name, version):
+    local_versions[name] = (
+        version, monotonic() + settings.DATA_VERSION_CACHE_TIMEOUT
+    )
+
+
+def get_stored_versions(names):
+    '''
+    Версии из базы данных. Прочитанная версия хранится в памяти процесса
+    DATA_VERSION_CACHE_TIMEOUT секунд, поэтому на горячем пути запросов
+    к базе данных нет, а изменения из других процессов видны с задержкой
+    не больше этого времени.
+    '''
+    now = monotonic()
+    found = {}
+    for name in names:
+        version, expires = local_versions.get(name, (None, 0))
+        if expires > now:
+            found[name] = version
+    expired = [name for name in names if name not in found]
+    if not expired:
+        return found
+    found.update(DataVersion.objects.filter(
+        name__in=expired
+    ).values_list('name', 'version'))
+    for name in set(expired) - set(found):
+        found[name] = DataVersion.objects.get_or_create(
+            name=name, defaults={'version': time_ns()}
+        )[0].version
+    for name in expired:
+        remember_version(name, found[name])
+    return found
+
+
+def get_versions(*names):
+    '''
+    Версии наборов данных, общие для процессов.
+    Версии справочников из STORED_VERSIONS читаются из базы данных одним
+    запросом не чаще раза в DATA_VERSION_CACHE_TIMEOUT секунд,
+    остальные — из кэша Django.
+    Процессы сравнивают их со своими, чтобы понять, что их кэш устарел.
+    Версия — время последнего изменения в наносекундах.
+    '''
+    stored = [name for name in names if name in STORED_VERSIONS]
+    found = get_stored_versions(stored) if stored else {}
+    return [
+        found[name] if name in found else get_cached_version(name)
+        for name in names
+    ]
+
+
+def get_version(name):
+    '''Версия одного набора данных, см. get_versions.'''
+    return get_versions(name)[0]
+
+
+def bump_version(name):
+    '''Делает устаревшими все кэши набора данных.'''
+    version = time_ns()
+    if name not in STORED_VERSIONS:
+        versions.set(name, version)
+        return
+    if not DataVersion.objects.filter(name=name).update(version=version):
+        DataVersion.objects.get_or_create(
+            name=name, defaults={'version': version}
+        )
+    remember_version(name, version)
+
+
+class VersionBump:
+    '''Отложенная смена версии набора данных name.'''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self):
+        bump_version(self.name)
+
+
+def bump_version_on_commit(name):
+    '''
+    Меняет версию после фиксации транзакции, один раз на транзакцию.
+    Массовые операции, например удаление всех ингредиентов, отправляют
+    сигнал на каждую строку, а версия меняется только один раз.
+    '''
+    connection = transaction.get_connection()
+    for _, callback, *_ in connection.run_on_commit:
+        if isinstance(callback, VersionBump) and callback.name == name:
+            return
+    transaction.on_commit(VersionBump(name))
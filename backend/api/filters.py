@@ -1,27 +1,52 @@
+from django import forms
 from django_filters.rest_framework import FilterSet, filters
 from recipes.models import Ingredient, Recipe
 
+from .search import search_ingredients
+
+
+class AnyValueMultipleChoiceField(forms.TypedMultipleChoiceField):
+    '''Поле для нескольких значений без проверки по списку вариантов.'''
+
+    def valid_value(self, value):
+        return True
+
+
+class MultipleValuesFilter(filters.TypedMultipleChoiceFilter):
+    '''
+    Фильтр по нескольким значениям параметра.
+    В отличие от AllValuesMultipleFilter не загружает из базы
+    все значения поля для проверки при каждом запросе.
+    '''
+    field_class = AnyValueMultipleChoiceField
+
 
 class IngredientFilter(FilterSet):
-    '''Фильтр по названию ингредиента.'''
-    name = filters.CharFilter(
-        field_name='title', lookup_expr='istartswith')
+    '''
+    Фильтр по названию ингредиента.
+    Совпадения с начала названия идут первыми, затем вхождения в середине.
+    '''
+    name = filters.CharFilter(method='get_name')
 
     class Meta:
         model = Ingredient
         fields = ('name',)
 
+    def get_name(self, queryset, name, value):
+        return search_ingredients(queryset, value)
+
 
 class RecipeFilter(FilterSet):
     '''
     Фильтр рецепта.
     Доступна фильтрация по избранному, автору, списку покупок и тегам.
     '''
-    tags = filters.AllValuesMultipleFilter(
+    tags = MultipleValuesFilter(
         field_name='tags__slug'
     )
-    author = filters.AllValuesMultipleFilter(
-        field_name='author__id'
+    author = MultipleValuesFilter(
+        field_name='author__id',
+        coerce=int
     )
     is_favorited = filters.BooleanFilter(
         method='get_is_favorited'
@@ -0,0 +1,232 @@
+import binascii
+import logging
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+from rest_framework import serializers
+
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+BASE64_CHUNK_SIZE = 64 * 1024
+IMAGE_EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+IMAGE_BACKGROUND = (255, 255, 255)
+# Ошибки Pillow при разборе заголовка и декодировании поврежденных данных.
+IMAGE_ERRORS = (OSError, SyntaxError, ValueError, Image.DecompressionBombError)
+
+
+def decode_base64(data):
+    '''
+    Декодирует base64 частями во временный файл.
+    Размер проверяется до декодирования, поэтому слишком большое
+    изображение отклоняется без выделения памяти под него.
+    '''
+    data = ''.join(data.split())
+    if len(data) * 3 // 4 > settings.IMAGE_MAX_UPLOAD_SIZE:
+        raise serializers.ValidationError(
+            'Размер изображения превышает '
+            f'{settings.IMAGE_MAX_UPLOAD_SIZE // (1024 * 1024)} МБ.'
+        )
+    file = SpooledTemporaryFile(max_size=settings.IMAGE_MAX_UPLOAD_SIZE)
+    try:
+        for start in range(0, len(data), BASE64_CHUNK_SIZE):
+            file.write(binascii.a2b_base64(
+                data[start:start + BASE64_CHUNK_SIZE]
+            ))
+    except binascii.Error:
+        file.close()
+        raise serializers.ValidationError('Некорректные данные base64.')
+    file.seek(0)
+    return file
+
+
+def save_image(image, size):
+    '''Уменьшает изображение до size и кодирует в IMAGE_FORMAT.'''
+    image = image.copy()
+    image.thumbnail(size)
+    buffer = BytesIO()
+    image.save(
+        buffer,
+        settings.IMAGE_FORMAT,
+        quality=settings.IMAGE_QUALITY,
+        optimize=True
+    )
+    return buffer.getvalue()
+
+
+def remove_alpha(image):
+    '''
+    Изображение в RGB. Прозрачные пиксели накладываются
+    на фон IMAGE_BACKGROUND, для WebP прозрачность сохраняется.
+    '''
+    if image.mode not in ('RGBA', 'LA', 'PA') and not (
+        image.mode == 'P' and 'transparency' in image.info
+    ):
+        return image.convert('RGB')
+    image = image.convert('RGBA')
+    if settings.IMAGE_FORMAT == 'WEBP':
+        return image
+    background = Image.new('RGB', image.size, IMAGE_BACKGROUND)
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def open_image(file):
+    '''
+    Открывает изображение с проверкой кол-ва пикселей
+    до загрузки данных изображения в память.
+    Поврежденные данные обнаруживаются при декодировании
+    и тоже считаются ошибкой проверки.
+    '''
+    try:
+        image = Image.open(file)
+    except IMAGE_ERRORS:
+        raise serializers.ValidationError(
+            'Загрузите корректное изображение.'
+        )
+    width, height = image.size
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise serializers.ValidationError(
+            f'Изображение больше {settings.IMAGE_MAX_PIXELS} пикселей.'
+        )
+    try:
+        return remove_alpha(ImageOps.exif_transpose(image))
+    except IMAGE_ERRORS:
+        raise serializers.ValidationError(
+            'Загрузите корректное изображение.'
+        )
+
+
+def process_upload(data):
+    '''
+    Изображение из data URL: декодирование, проверка размеров
+    и перекодирование в IMAGE_FORMAT с качеством IMAGE_QUALITY.
+    '''
+    with decode_base64(data) as file:
+        image = open_image(file)
+        content = save_image(image, settings.IMAGE_MAX_SIDE)
+    extension = IMAGE_EXTENSIONS[settings.IMAGE_FORMAT]
+    return ContentFile(content, name=f'{uuid4().hex}.{extension}')
+
+
+def thumbnail_name(name, variant):
+    '''Имя миниатюры рядом с оригиналом изображения.'''
+    root, _ = os.path.splitext(name)
+    extension = IMAGE_EXTENSIONS[settings.IMAGE_FORMAT]
+    return f'{root}.{variant}.{extension}'
+
+
+def generate_thumbnails(name):
+    '''
+    Создает недостающие миниатюры размеров THUMBNAIL_SIZES.
+    Имена изображений уникальны, поэтому готовая миниатюра не меняется.
+    Если миниатюру одновременно сохранил другой процесс, хранилище
+    дает копии другое имя, и копия удаляется.
+    '''
+    sizes = {
+        thumbnail_name(name, variant): size
+        for variant, size in settings.THUMBNAIL_SIZES.items()
+    }
+    missing = [path for path in sizes if not default_storage.exists(path)]
+    if not missing:
+        return
+    with default_storage.open(name) as file:
+        image = open_image(file)
+        for path in missing:
+            saved = default_storage.save(
+                path, ContentFile(save_image(image, sizes[path]))
+            )
+            if saved != path:
+                default_storage.delete(saved)
+
+
+# Известные миниатюры и имена изображений, для которых создать
+# миниатюры не удалось (значение False).
+existing_thumbnails = LRUCache(
+    settings.THUMBNAIL_CACHE_SIZE, get_size=lambda value: 1
+)
+
+
+def get_thumbnail(name, variant):
+    '''
+    Имя миниатюры изображения.
+    Если миниатюры еще нет, ее создание ставится в фоновый пул, а до его
+    завершения возвращается None. Для изображений, миниатюры которых
+    создать не удалось, повторной попытки нет.
+    '''
+    path = thumbnail_name(name, variant)
+    if existing_thumbnails.get(path):
+        return path
+    if name in pending_thumbnails or existing_thumbnails.get(name) is False:
+        return None
+    if not default_storage.exists(path):
+        future = schedule_thumbnails(name)
+        if not future.done() or future.exception() is not None:
+            return None
+    existing_thumbnails.set(path, True)
+    return path
+
+
+class ImmediateExecutor:
+    '''Выполняет задачи сразу в вызывающем потоке, замена пула для тестов.'''
+
+    def submit(self, function, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(function(*args, **kwargs))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+
+_executor = None
+pending_thumbnails = {}
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        if settings.IMAGE_PIPELINE_SYNC:
+            _executor = ImmediateExecutor()
+        else:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS,
+                thread_name_prefix='images'
+            )
+    return _executor
+
+
+def log_error(future):
+    if future.exception() is not None:
+        logger.error(
+            'Не удалось создать миниатюры', exc_info=future.exception()
+        )
+
+
+def finish_thumbnails(name, future):
+    if future.exception() is not None:
+        existing_thumbnails.set(name, False)
+    if pending_thumbnails.get(name) is future:
+        pending_thumbnails.pop(name, None)
+    log_error(future)
+
+
+def schedule_thumbnails(name):
+    '''
+    Ставит создание миниатюр в фоновый пул потоков.
+    До завершения задачи get_thumbnail не создает миниатюры сам.
+    '''
+    future = get_executor().submit(generate_thumbnails, name)
+    pending_thumbnails[name] = future
+    future.add_done_callback(
+        lambda future: finish_thumbnails(name, future)
+    )
+    return future
@@ -0,0 +1,105 @@
+from bisect import bisect_left
+from difflib import get_close_matches
+
+from django.db import DatabaseError
+from recipes.models import Ingredient
+
+from .cache import INGREDIENTS_VERSION, get_version
+
+SEQUENCE_SIMILARITY = 0.6
+TYPO_NEIGHBOURHOOD = 20
+
+
+def normalize(title):
+    '''Приводит название к виду для сравнения без учета регистра и «ё».'''
+    return title.casefold().replace('ё', 'е')
+
+
+class IngredientIndex:
+    '''
+    Индекс ингредиентов в памяти процесса.
+    Названия хранятся отсортированным массивом, поиск по префиксу
+    выполняется бинарным поиском.
+    '''
+
+    def __init__(self, ingredients):
+        rows = sorted(
+            (normalize(title), id, title, measure_unit)
+            for id, title, measure_unit in ingredients
+        )
+        self.keys = [row[0] for row in rows]
+        self.items = [
+            {'id': id, 'name': title, 'measurement_unit': measure_unit}
+            for _, id, title, measure_unit in rows
+        ]
+
+    def search(self, value):
+        '''
+        Сначала совпадения с начала названия, затем вхождения в середине,
+        при отсутствии вхождений — похожие названия.
+        '''
+        value = normalize(value)
+        start = bisect_left(self.keys, value)
+        end = start
+        while end < len(self.keys) and self.keys[end].startswith(value):
+            end += 1
+        found = self.items[start:end]
+        found.extend(
+            self.items[position]
+            for position, key in enumerate(self.keys)
+            if value in key and not key.startswith(value)
+        )
+        if found or not value:
+            return found
+        return self.search_similar(value, start)
+
+    def search_similar(self, value, position):
+        '''
+        Похожие названия для исправления опечаток.
+        Сравниваются только TYPO_NEIGHBOURHOOD названий по обе стороны
+        от позиции value в отсортированном массиве с той же первой буквой,
+        чтобы поиск не перебирал весь справочник.
+        '''
+        first = bisect_left(self.keys, value[0])
+        last = bisect_left(self.keys, chr(ord(value[0]) + 1))
+        start = max(first, position - TYPO_NEIGHBOURHOOD)
+        end = min(last, position + TYPO_NEIGHBOURHOOD)
+        positions = {
+            self.keys[position]: position for position in range(start, end)
+        }
+        return [
+            self.items[positions[key]]
+            for key in get_close_matches(
+                value, positions, cutoff=SEQUENCE_SIMILARITY
+            )
+        ]
+
+
+_index = None
+_index_version = None
+
+
+def get_ingredient_index(version=None):
+    '''
+    Индекс ингредиентов текущей версии.
+    Перестраивается, если версия в базе данных изменилась после импорта
+    или правки ингредиентов, в том числе в другом процессе.
+    Уже прочитанную в запросе версию можно передать в version.
+    '''
+    global _index, _index_version
+    if version is None:
+        version = get_version(INGREDIENTS_VERSION)
+    if _index is None or _index_version != version:
+        _index = IngredientIndex(
+            Ingredient.objects.values_list('id', 'title', 'measure_unit')
+        )
+        _index_version = version
+    return _index
+
+
+def warm_up():
+    '''Строит индекс при старте процесса, если база данных доступна.'''
+    try:
+        get_ingredient_index()
+    except DatabaseError:
+        pass
@@ -0,0 +1,165 @@
+import json
+import logging
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from rest_framework import serializers
+
+from .cache import cache_counters
+
+logger = logging.getLogger(__name__)
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    '''Запрос выполнил больше SQL-запросов, чем допускает бюджет.'''
+
+
+class RequestMetrics:
+    '''
+    Метрики запроса: кол-во SQL-запросов, время в базе данных,
+    время сериализации и попадания в кэш по пространствам имен.
+    Подключается к соединениям через execute_wrapper.
+    '''
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.cache = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - start
+            self.queries += 1
+
+    @contextmanager
+    def collect(self):
+        '''Считает запросы ко всем базам данных внутри блока.'''
+        token = current_metrics.set(self)
+        counters_token = cache_counters.set(self.cache)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self))
+                yield self
+        finally:
+            cache_counters.reset(counters_token)
+            current_metrics.reset(token)
+
+
+class TimedSerializerMixin:
+    '''
+    Учитывает время формирования data в метриках запроса.
+    Вложенные вызовы data не учитываются повторно.
+    '''
+
+    @property
+    def data(self):
+        metrics = current_metrics.get()
+        if metrics is None or metrics.serializer_depth:
+            return super().data
+        metrics.serializer_depth += 1
+        start = perf_counter()
+        try:
+            return super().data
+        finally:
+            metrics.serializer_time += perf_counter() - start
+            metrics.serializer_depth -= 1
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    '''Список объектов с учетом времени сериализации.'''
+
+
+def get_view_action(request):
+    '''Класс вьюсета и действие, которые обработали запрос.'''
+    match = request.resolver_match
+    view_class = getattr(getattr(match, 'func', None), 'cls', None)
+    actions = getattr(match.func, 'actions', None) if view_class else None
+    if not actions:
+        return view_class, None
+    return view_class, actions.get(request.method.lower())
+
+
+def get_query_budget(view_class, action):
+    '''Бюджет SQL-запросов из query_budgets вьюсета.'''
+    budgets = getattr(view_class, 'query_budgets', None) or {}
+    return budgets.get(action)
+
+
+def check_query_budget(queries, budget, name):
+    if budget is not None and queries > budget:
+        raise QueryBudgetExceeded(
+            f'{name}: {queries} SQL-запросов при бюджете {budget}.'
+        )
+
+
+class InstrumentationMiddleware:
+    '''
+    Метрики запросов к API: кол-во SQL-запросов, время в базе данных,
+    время сериализации, общее время, размер ответа и попадания в кэш.
+    Отдаются в заголовке Server-Timing и пишутся в журнал api.instrumentation
+    одной строкой JSON. Превышение query_budgets вьюсета отмечается
+    в журнале, а при QUERY_BUDGETS_STRICT вызывает QueryBudgetExceeded.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path.startswith(settings.API_METRICS_PREFIX):
+            return self.get_response(request)
+        start = perf_counter()
+        with RequestMetrics().collect() as metrics:
+            response = self.get_response(request)
+        total_time = perf_counter() - start
+        view_class, action = get_view_action(request)
+        budget = get_query_budget(view_class, action)
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={metrics.db_time * 1000:.1f};'
+            f'desc="{metrics.queries} queries"',
+            f'serializer;dur={metrics.serializer_time * 1000:.1f}',
+            f'total;dur={total_time * 1000:.1f}',
+        ))
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': view_class.__name__ if view_class else None,
+            'action': action,
+            'status': response.status_code,
+            'queries': metrics.queries,
+            'query_budget': budget,
+            'over_budget': budget is not None and metrics.queries > budget,
+            'db_ms': round(metrics.db_time * 1000, 1),
+            'serializer_ms': round(metrics.serializer_time * 1000, 1),
+            'total_ms': round(total_time * 1000, 1),
+            'size': None if response.streaming else len(response.content),
+            'cache': metrics.cache,
+        }
+        log = logger.warning if record['over_budget'] else logger.info
+        log(json.dumps(record, ensure_ascii=False))
+        if settings.QUERY_BUDGETS_STRICT:
+            check_query_budget(
+                metrics.queries, budget, f'{record["view"]}.{action}'
+            )
+        return response
+
+
+@contextmanager
+def query_budget(budget, name='Блок'):
+    '''
+    Утилита для тестов: проверяет, что код внутри блока выполнил
+    не больше budget SQL-запросов, иначе вызывает QueryBudgetExceeded.
+    '''
+    with RequestMetrics().collect() as metrics:
+        yield metrics
+    check_query_budget(metrics.queries, budget, name)
@@ -0,0 +1,47 @@
+from statistics import mean, quantiles
+from time import perf_counter
+
+from api.ingredient_index import get_ingredient_index
+from api.search import search_ingredients
+from django.core.management.base import BaseCommand
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = 'Замер времени автодополнения ингредиентов по мере набора слова'
+
+    def add_arguments(self, parser):
+        parser.add_argument('words', nargs='*', default=(
+            'молоко', 'сахар', 'Мука', 'перец', 'яйцо', 'томат', 'малако'
+        ))
+        parser.add_argument('--iterations', type=int, default=20)
+
+    def measure(self, search, words, iterations):
+        timings = []
+        for _ in range(iterations):
+            for word in words:
+                for length in range(1, len(word) + 1):
+                    start = perf_counter()
+                    search(word[:length])
+                    timings.append((perf_counter() - start) * 1000)
+        return (
+            f'запросов {len(timings)}, '
+            f'среднее {mean(timings):.3f} мс, '
+            f'p95 {quantiles(timings, n=20)[-1]:.3f} мс'
+        )
+
+    def handle(self, *args, **options):
+        words, iterations = options['words'], options['iterations']
+        database = self.measure(
+            lambda value: list(search_ingredients(
+                Ingredient.objects.all(), value
+            )[:10]),
+            words,
+            iterations
+        )
+        index = get_ingredient_index()
+        memory = self.measure(index.search, words, iterations)
+        self.stdout.write(
+            f'Фильтр IngredientFilter: {database}\n'
+            f'Индекс в памяти: {memory}'
+        )
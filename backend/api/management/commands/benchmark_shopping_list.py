@@ -0,0 +1,49 @@
+from time import perf_counter
+
+from api.utils import render_pdf
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from reportlab.pdfbase.pdfmetrics import registerFont
+from reportlab.pdfbase.ttfonts import TTFont
+
+
+class Command(BaseCommand):
+    help = (
+        'Замер времени формирования pdf-списка покупок: '
+        'с загрузкой шрифта на каждый запрос и с кэшем шрифта'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--ingredients', type=int, default=40)
+
+    def render(self, shopping_list, load_font):
+        if load_font:
+            registerFont(TTFont(
+                'Helvetica', settings.PDF_FONT_PATH, 'Helvetica.ttf'))
+        for _ in render_pdf(shopping_list):
+            pass
+
+    def measure(self, shopping_list, iterations, load_font):
+        start = perf_counter()
+        for _ in range(iterations):
+            self.render(shopping_list, load_font)
+        return (perf_counter() - start) / iterations * 1000
+
+    def handle(self, *args, **options):
+        shopping_list = [
+            {
+                'name': f'Ингредиент {number}',
+                'measurement_unit': 'г',
+                'amount': number,
+            }
+            for number in range(options['ingredients'])
+        ]
+        self.render(shopping_list, load_font=False)
+        iterations = options['iterations']
+        per_request = self.measure(shopping_list, iterations, True)
+        cached = self.measure(shopping_list, iterations, False)
+        self.stdout.write(
+            f'Шрифт загружается на каждый запрос: {per_request:.2f} мс\n'
+            f'Шрифт из кэша процесса: {cached:.2f} мс'
+        )
@@ -0,0 +1,120 @@
+from hashlib import sha1
+
+from django.contrib.auth.models import AnonymousUser
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from .cache import get_version, get_versions
+
+
+def conditional_response(request, render, etag_parts, last_modified=None,
+                         **cache_control):
+    '''
+    Условный GET-запрос.
+    Если ETag или Last-Modified совпадают с заголовками запроса,
+    отдается 304 без формирования тела ответа.
+    '''
+    etag = quote_etag(sha1(repr(etag_parts).encode()).hexdigest())
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        response = render()
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, **cache_control)
+    if cache_control.get('private'):
+        patch_vary_headers(response, ('Authorization',))
+    return response
+
+
+class VersionedReadOnlyMixin:
+    '''
+    Кэширование HTTP для справочников.
+    ETag и Last-Modified вычисляются по версии набора данных,
+    общей для всех процессов. Версия читается один раз за запрос
+    и доступна при формировании ответа в data_version.
+    '''
+    version_name = None
+    cache_max_age = 60
+    data_version = None
+
+    def versioned_response(self, request, render):
+        version = self.data_version = get_version(self.version_name)
+        return conditional_response(
+            request,
+            render,
+            (version, request.get_full_path()),
+            last_modified=version // 10 ** 9,
+            public=True,
+            max_age=self.cache_max_age,
+        )
+
+    def list(self, request, *args, **kwargs):
+        return self.versioned_response(
+            request, lambda: super(VersionedReadOnlyMixin, self).list(
+                request, *args, **kwargs
+            )
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.versioned_response(
+            request, lambda: super(VersionedReadOnlyMixin, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
+
+
+class SharedListCacheMixin:
+    '''
+    Кэширование списка, общего для всех пользователей.
+    Страница без отметок пользователя кэшируется по адресу запроса
+    и версиям наборов данных из list_versions, отметки текущего
+    пользователя добавляются в personalize_list() при ответе.
+    Запросы с параметрами из list_cache_bypass_params, результат которых
+    зависит от пользователя, кэш не используют.
+    '''
+    list_cache = None
+    list_versions = ()
+    list_cache_bypass_params = ()
+    shared_list = False
+
+    def get_flags_user(self):
+        '''Пользователь, для которого вычисляются отметки в выборке.'''
+        if self.shared_list:
+            return AnonymousUser()
+        return self.request.user
+
+    def get_list_cache_key(self, request):
+        params = sorted(
+            (name, sorted(values))
+            for name, values in request.query_params.lists()
+        )
+        return sha1(repr((
+            get_versions(*self.list_versions),
+            request.get_host(),
+            params,
+        )).encode()).hexdigest()
+
+    def personalize_list(self, data):
+        return data
+
+    def list(self, request, *args, **kwargs):
+        if not request.user.is_anonymous and any(
+            name in request.query_params
+            for name in self.list_cache_bypass_params
+        ):
+            return super().list(request, *args, **kwargs)
+        key = self.get_list_cache_key(request)
+        data = self.list_cache.get(key)
+        if data is None:
+            self.shared_list = True
+            data = super().list(request, *args, **kwargs).data
+            self.shared_list = False
+            self.list_cache.set(key, data)
+        if request.user.is_anonymous:
+            return Response(data)
+        return Response(self.personalize_list(data))
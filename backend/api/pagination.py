@@ -1,9 +1,179 @@
+from hashlib import sha1
+
 from django.conf import settings
-from rest_framework.pagination import PageNumberPagination
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+from .cache import (COUNTS_VERSION, CacheNamespace, bump_version_on_commit,
+                    get_version)
+
+counts = CacheNamespace(
+    'counts', timeout=settings.PAGINATION_COUNT_CACHE_TIMEOUT
+)
+
+
+def invalidate_counts():
+    '''Сбрасывает кэш кол-ва объектов после фиксации транзакции.'''
+    bump_version_on_commit(COUNTS_VERSION)
+
+
+def get_user_counts_version(user_id):
+    return f'{COUNTS_VERSION}:{user_id}'
+
+
+def invalidate_user_counts(user_id):
+    '''
+    Сбрасывает кэш кол-ва объектов, зависящего от подписок и отметок
+    пользователя, после фиксации транзакции. Общий кэш не затрагивается.
+    '''
+    bump_version_on_commit(get_user_counts_version(user_id))
+
+
+def estimate_count(queryset):
+    '''
+    Оценка кол-ва строк таблицы по статистике PostgreSQL.
+    Возвращает None для других баз, для запросов с фильтрами
+    и для таблиц меньше PAGINATION_ESTIMATE_MIN_ROWS строк.
+    '''
+    query = queryset.query
+    connection = connections[queryset.db]
+    if (
+        connection.vendor != 'postgresql'
+        or query.where
+        or query.distinct
+        or query.low_mark
+        or query.high_mark is not None
+    ):
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class '
+            'WHERE oid = %s::regclass',
+            (queryset.model._meta.db_table,)
+        )
+        row = cursor.fetchone()
+    if row is None or row[0] < settings.PAGINATION_ESTIMATE_MIN_ROWS:
+        return None
+    return row[0]
+
+
+class CachedCountPaginator(Paginator):
+    '''
+    Пагинатор с кэшированием общего кол-ва объектов.
+    Кол-во хранится в кэше по SQL-запросу выборки до изменения данных
+    (COUNTS_VERSION) или истечения PAGINATION_COUNT_CACHE_TIMEOUT, для таблиц
+    без фильтров в PostgreSQL берется оценка из pg_class.
+    Если выборка зависит от подписок и отметок пользователя user_id,
+    ключ включает еще и его версию, которую сбрасывает invalidate_user_counts.
+    С exact_count всегда выполняется COUNT(*).
+    '''
+
+    def __init__(self, *args, exact_count=False, user_id=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.exact_count = exact_count
+        self.user_id = user_id
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if self.exact_count or not hasattr(queryset, 'query'):
+            return super().count
+        sql, params = queryset.order_by().values('pk').query.sql_with_params()
+        user_version = None
+        if self.user_id is not None:
+            user_version = get_version(get_user_counts_version(self.user_id))
+        key = sha1(repr((
+            get_version(COUNTS_VERSION), user_version, queryset.db, sql, params
+        )).encode()).hexdigest()
+        count = counts.get(key)
+        if count is None:
+            count = estimate_count(queryset)
+            if count is None:
+                count = super().count
+            counts.set(key, count)
+        return count
 
 
 class CustomPagination(PageNumberPagination):
-    '''Кастомная пагинация.'''
+    '''
+    Кастомная пагинация.
+    Общее кол-во объектов берется из кэша CachedCountPaginator,
+    с параметром count=exact считается точно.
+    Кол-во зависит от подписок и отметок пользователя при count_per_user
+    и при наличии параметров из user_count_params.
+    '''
     page_size = settings.PAGE_SIZE
     page_size_query_param = 'limit'
     max_page_size = settings.MAX_PAGE_SIZE
+    count_query_param = 'count'
+    count_per_user = False
+    user_count_params = ()
+    exact_count = False
+    count_user_id = None
+
+    def django_paginator_class(self, queryset, page_size):
+        return CachedCountPaginator(
+            queryset,
+            page_size,
+            exact_count=self.exact_count,
+            user_id=self.count_user_id
+        )
+
+    def get_count_user_id(self, request):
+        if not request.user.is_authenticated:
+            return None
+        if self.count_per_user or any(
+            param in request.query_params for param in self.user_count_params
+        ):
+            return request.user.id
+        return None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.exact_count = (
+            request.query_params.get(self.count_query_param) == 'exact'
+        )
+        self.count_user_id = self.get_count_user_id(request)
+        return super().paginate_queryset(queryset, request, view)
+
+
+class SubscriptionPagination(CustomPagination):
+    '''Пагинация подписок текущего пользователя.'''
+    count_per_user = True
+
+
+class RecipeCursorPagination(CursorPagination):
+    '''
+    Пагинация ленты рецептов по курсору.
+    Позиция задается временем публикации и использует индекс
+    recipe_feed_idx, поэтому глубокие страницы не требуют OFFSET и COUNT.
+    '''
+    page_size = settings.PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = settings.MAX_PAGE_SIZE
+    ordering = ('-time_create', '-id')
+
+
+class RecipePagination(CustomPagination):
+    '''
+    Пагинация ленты рецептов.
+    По умолчанию постраничная, с параметром cursor (в том числе пустым
+    для первой страницы) — по курсору через RecipeCursorPagination.
+    '''
+    cursor_query_param = 'cursor'
+    user_count_params = ('is_favorited', 'is_in_shopping_cart')
+    cursor_pagination = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params:
+            self.cursor_pagination = RecipeCursorPagination()
+            return self.cursor_pagination.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response(data)
+        return super().get_paginated_response(data)
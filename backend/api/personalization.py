@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.db import transaction
+from recipes.models import Cart, FavoriteRecipe
+from users.models import Subscription
+
+from .cache import CacheNamespace
+
+user_marks = CacheNamespace(
+    'user_marks', timeout=settings.USER_MARKS_CACHE_TIMEOUT
+)
+
+
+def get_user_marks(user):
+    '''
+    Отметки пользователя: id рецептов в избранном и в корзине
+    и id авторов в подписках. Хранятся в кэше по пользователю.
+    '''
+    marks = user_marks.get(user.pk)
+    if marks is None:
+        marks = {
+            'favorites': frozenset(FavoriteRecipe.objects.filter(
+                user=user
+            ).values_list('recipe_id', flat=True)),
+            'cart': frozenset(Cart.objects.filter(
+                user=user
+            ).values_list('recipe_id', flat=True)),
+            'following': frozenset(Subscription.objects.filter(
+                user=user
+            ).values_list('author_id', flat=True)),
+        }
+        user_marks.set(user.pk, marks)
+    return marks
+
+
+def invalidate_user_marks(user_id):
+    '''
+    Сбрасывает отметки пользователя сразу и после фиксации транзакции:
+    параллельный запрос мог закэшировать отметки до изменения.
+    '''
+    user_marks.delete(user_id)
+    transaction.on_commit(lambda: user_marks.delete(user_id))
+
+
+def apply_user_marks(recipe, marks):
+    '''Переносит отметки пользователя на общие данные рецепта.'''
+    author = recipe['author']
+    return {
+        **recipe,
+        'author': {
+            **author,
+            'is_subscribed': author['id'] in marks['following'],
+        },
+        'is_favorited': recipe['id'] in marks['favorites'],
+        'is_in_shopping_cart': recipe['id'] in marks['cart'],
+    }
@@ -0,0 +1,30 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class FileRenderer(BaseRenderer):
+    '''
+    Рендерер файлов списка покупок.
+    Нужен для выбора формата через `?format=`; сам файл формирует вьюсет.
+    Ошибки отдаются в JSON.
+    '''
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        return JSONRenderer().render(data)
+
+
+class PDFRenderer(FileRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+
+
+class CSVRenderer(FileRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class TextRenderer(FileRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
@@ -0,0 +1,62 @@
+from django.db import connection
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.functions import Upper
+
+from .ingredient_index import get_ingredient_index
+
+TRIGRAM_SIMILARITY = 0.3
+
+
+def order_by_ids(queryset, ids):
+    '''Выборка объектов с сохранением порядка списка ids.'''
+    return queryset.filter(id__in=ids).order_by(Case(
+        *(When(id=id, then=Value(position))
+          for position, id in enumerate(ids)),
+        output_field=IntegerField()
+    ))
+
+
+def search_in_database(queryset, value):
+    '''
+    Поиск по индексам PostgreSQL.
+    Вхождение в название ищется по триграммному индексу на UPPER(title),
+    совпадения с начала названия показываются первыми.
+    Если вхождений нет, ищутся похожие названия для исправления опечаток.
+    '''
+    found = queryset.filter(title__icontains=value).annotate(
+        rank=Case(
+            When(title__istartswith=value, then=Value(0)),
+            default=Value(1),
+            output_field=IntegerField()
+        )
+    ).order_by('rank', 'title')
+    if found.exists():
+        return found
+    from django.contrib.postgres.search import TrigramSimilarity
+    return queryset.annotate(
+        similarity=TrigramSimilarity(Upper('title'), value.upper())
+    ).filter(
+        similarity__gt=TRIGRAM_SIMILARITY
+    ).order_by('-similarity', 'title')
+
+
+def search_in_memory(queryset, value):
+    '''
+    Поиск по индексу ингредиентов в памяти процесса
+    для баз без триграммного индекса.
+    В SQLite LIKE не учитывает регистр только для латиницы,
+    поэтому названия сравниваются в индексе после casefold().
+    '''
+    found = get_ingredient_index().search(value)
+    return order_by_ids(queryset, [ingredient['id'] for ingredient in found])
+
+
+def search_ingredients(queryset, value):
+    '''
+    Поиск ингредиентов по названию.
+    Сначала идут совпадения с начала названия, затем вхождения в середине
+    слова, при отсутствии вхождений — похожие названия.
+    '''
+    if connection.vendor == 'postgresql':
+        return search_in_database(queryset, value)
+    return search_in_memory(queryset, value)
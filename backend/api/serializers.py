@@ -1,14 +1,16 @@
-import base64
-
 import webcolors
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.db import transaction
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from recipes.models import (Cart, FavoriteRecipe, Ingredient,
                             IngredientsAmount, Recipe, Tag)
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 from rest_framework.validators import UniqueTogetherValidator
 from users.models import Subscription, User
 
+from .images import get_thumbnail, process_upload, schedule_thumbnails
+from .instrumentation import TimedListSerializer, TimedSerializerMixin
 from .validators import RecipeValidator
 
 
@@ -25,14 +27,89 @@ class Hex2NameColor(serializers.Field):
 
 
 class Base64ImageField(serializers.ImageField):
+    '''
+    Изображение в формате data URL.
+    Проходит проверку размера и перекодируется в IMAGE_FORMAT.
+    '''
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            _, separator, imgstr = data.partition(';base64,')
+            if not separator:
+                raise serializers.ValidationError(
+                    'Ожидается изображение в base64.'
+                )
+            data = process_upload(imgstr)
         return super().to_internal_value(data)
 
 
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    '''Список связанных объектов, которые загружаются одним запросом.'''
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        return self.child_relation.to_internal_value_many(data)
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    '''
+    Связь по первичному ключу.
+    С many=True все id проверяются одним запросом id__in,
+    ошибка выводится для каждого неизвестного id.
+    '''
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def to_internal_value_many(self, data):
+        pks, errors = [], []
+        for pk in data:
+            try:
+                pks.append(int(pk))
+            except (TypeError, ValueError):
+                errors.append(self.error_messages['incorrect_type'].format(
+                    data_type=type(pk).__name__
+                ))
+        objects = self.get_queryset().in_bulk(pks)
+        errors.extend(
+            self.error_messages['does_not_exist'].format(pk_value=pk)
+            for pk in pks if pk not in objects
+        )
+        if errors:
+            raise serializers.ValidationError(errors)
+        return [objects[pk] for pk in pks]
+
+
+class ThumbnailField(serializers.ReadOnlyField):
+    '''
+    Ссылка на миниатюру изображения размера variant из THUMBNAIL_SIZES.
+    Если миниатюры нет, отдается ссылка на оригинал.
+    '''
+
+    def __init__(self, variant, **kwargs):
+        self.variant = variant
+        kwargs.setdefault('source', 'image')
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        name = get_thumbnail(value.name, self.variant) or value.name
+        url = value.storage.url(name)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
 class IngredientSerializer(serializers.ModelSerializer):
     '''Сериализатор для ингредиентов.'''
     name = serializers.ReadOnlyField(source='title')
@@ -52,15 +129,42 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'color', 'slug')
 
 
+class AmountIngredientListSerializer(serializers.ListSerializer):
+    '''
+    Список ингредиентов рецепта.
+    Все id ингредиентов проверяются одним запросом id__in.
+    '''
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        ingredients = Ingredient.objects.in_bulk(
+            {item['id'] for item in items}
+        )
+        errors = []
+        for item in items:
+            ingredient = ingredients.get(item['id'])
+            if ingredient is None:
+                errors.append({'id': [
+                    serializers.PrimaryKeyRelatedField.default_error_messages[
+                        'does_not_exist'
+                    ].format(pk_value=item['id'])
+                ]})
+                continue
+            errors.append({})
+            item['id'] = ingredient
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return items
+
+
 class AmountIngredientSerializer(serializers.ModelSerializer):
     '''Сериализатор промежуточной модели кол-ва ингридиентов.'''
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    id = serializers.IntegerField()
 
     class Meta:
         model = IngredientsAmount
         fields = ('id', 'amount')
+        list_serializer_class = AmountIngredientListSerializer
 
 
 class IngredientsListSerializer(serializers.ModelSerializer):
@@ -92,7 +196,7 @@ class CreateUserSerializer(UserCreateSerializer):
         extra_kwargs = {'password': {'write_only': True}}
 
 
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(TimedSerializerMixin, UserSerializer):
     '''Сериализатор для  пользователя.'''
     is_subscribed = serializers.SerializerMethodField(read_only=True)
 
@@ -106,15 +210,19 @@ class CustomUserSerializer(UserSerializer):
             'last_name',
             'is_subscribed'
         )
+        list_serializer_class = TimedListSerializer
 
     def get_is_subscribed(self, obj):
-        request = self.context['request']
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
-        return obj.author.filter(author=request.user).exists()
+        return obj.author.filter(user=request.user).exists()
 
 
-class ListOfRecipesSerializer(serializers.ModelSerializer):
+class ListOfRecipesSerializer(TimedSerializerMixin,
+                              serializers.ModelSerializer):
     '''
     Сериализатор для получения списка рецептов.
     '''
@@ -125,6 +233,8 @@ class ListOfRecipesSerializer(serializers.ModelSerializer):
     ingredients = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
+    image_small = ThumbnailField('small')
+    image_medium = ThumbnailField('medium')
 
     class Meta:
         model = Recipe
@@ -137,17 +247,22 @@ class ListOfRecipesSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_small',
+            'image_medium',
             'text',
             'cooking_time',
         )
+        list_serializer_class = TimedListSerializer
 
     def get_ingredients(self, obj):
         '''Получает ингредиенты из модели IngredientsAmount.'''
-        ingredients = IngredientsAmount.objects.filter(recipe=obj)
+        ingredients = obj.ingredient_to_recipe.all()
         return IngredientsListSerializer(ingredients, many=True).data
 
     def get_is_favorited(self, obj):
         '''Показывает рецепты в избранном.'''
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context['request'].user
         if request.is_anonymous:
             return False
@@ -158,19 +273,22 @@ class ListOfRecipesSerializer(serializers.ModelSerializer):
 
     def get_is_in_shopping_cart(self, obj):
         '''Показывает рецепты в корзине.'''
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context['request']
         if request.user.is_anonymous:
             return False
         return request.user.user_cart.filter(recipe=obj).exists()
 
 
-class CreateUpdateRecipesSerializer(serializers.ModelSerializer):
+class CreateUpdateRecipesSerializer(TimedSerializerMixin,
+                                    serializers.ModelSerializer):
     '''
     Сериализатор для создания и обновления рецептов.
     '''
     name = serializers.CharField(source='title')
     text = serializers.CharField(source='description')
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = BulkPrimaryKeyRelatedField(
         queryset=Tag.objects.all(), many=True
     )
     author = CustomUserSerializer(read_only=True)
@@ -193,6 +311,7 @@ class CreateUpdateRecipesSerializer(serializers.ModelSerializer):
             'text',
             'cooking_time'
         )
+        list_serializer_class = TimedListSerializer
 
     def validate(self, fields):
         '''Валидация полей рецепта.'''
@@ -216,26 +335,59 @@ class CreateUpdateRecipesSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def add_ingredients(recipe, ingredients):
-        '''Добавляет ингредиенты.'''
-        for ingredient in ingredients:
-            IngredientsAmount.objects.create(
+        '''Добавляет ингредиенты одним INSERT.'''
+        IngredientsAmount.objects.bulk_create(
+            IngredientsAmount(
                 ingredient=ingredient.get('id'),
                 recipe=recipe,
                 amount=ingredient.get('amount'))
+            for ingredient in ingredients
+        )
 
+    @staticmethod
+    def update_ingredients(recipe, ingredients):
+        '''
+        Обновляет ингредиенты по разнице с сохраненными:
+        удаляет убранные, меняет кол-во у измененных, добавляет новые.
+        '''
+        amounts = {
+            ingredient.get('id').id: ingredient.get('amount')
+            for ingredient in ingredients
+        }
+        removed, changed = [], []
+        for current in IngredientsAmount.objects.filter(recipe=recipe):
+            amount = amounts.pop(current.ingredient_id, None)
+            if amount is None:
+                removed.append(current.id)
+            elif amount != current.amount:
+                current.amount = amount
+                changed.append(current)
+        if removed:
+            IngredientsAmount.objects.filter(id__in=removed).delete()
+        if changed:
+            IngredientsAmount.objects.bulk_update(changed, ('amount',))
+        IngredientsAmount.objects.bulk_create(
+            IngredientsAmount(
+                ingredient_id=ingredient_id,
+                recipe=recipe,
+                amount=amount)
+            for ingredient_id, amount in amounts.items()
+        )
+
+    @transaction.atomic
     def create(self, validated_data):
         '''Метод создания рецепта.'''
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
-        for tag in tags:
-            recipe.tags.add(tag)
+        recipe.tags.set(tags)
         self.add_ingredients(recipe, ingredients)
+        transaction.on_commit(lambda: schedule_thumbnails(recipe.image.name))
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         '''Метод обновления рецепта.'''
-        old_recipe = instance
         instance.title = validated_data.get('title', instance.title)
         instance.image = validated_data.get('image', instance.image)
         instance.description = validated_data.get(
@@ -245,15 +397,13 @@ class CreateUpdateRecipesSerializer(serializers.ModelSerializer):
         instance.cooking_time = validated_data.get(
             'cooking_time', instance.cooking_time
         )
-        instance.tags.clear()
-        tags_data = validated_data.pop('tags')
-        instance.tags.set(tags_data)
-
-        instance.ingredients.clear()
-        ingredients = validated_data.pop('ingredients')
-        IngredientsAmount.objects.filter(recipe=old_recipe).delete()
-        self.add_ingredients(instance, ingredients)
+        instance.tags.set(validated_data.pop('tags'))
+        self.update_ingredients(instance, validated_data.pop('ingredients'))
         instance.save()
+        if 'image' in validated_data:
+            transaction.on_commit(
+                lambda: schedule_thumbnails(instance.image.name)
+            )
         return instance
 
     def get_is_favorited(self, obj):
@@ -273,15 +423,21 @@ class CreateUpdateRecipesSerializer(serializers.ModelSerializer):
             recipe=obj).exists()
 
     def to_representation(self, instance):
+        request = self.context['request']
+        instance = Recipe.objects.with_related().with_user_flags(
+            request.user
+        ).get(pk=instance.pk)
         return ListOfRecipesSerializer(
             instance,
-            context={'request': self.context['request']}
+            context={'request': request}
         ).data
 
 
-class ShortlistRecipesSerializer(serializers.ModelSerializer):
+class ShortlistRecipesSerializer(TimedSerializerMixin,
+                                 serializers.ModelSerializer):
     '''Сериализатор короткого списка рецептов.'''
     name = serializers.CharField(source='title')
+    image_small = ThumbnailField('small')
 
     class Meta:
         model = Recipe
@@ -289,8 +445,10 @@ class ShortlistRecipesSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_small',
             'cooking_time'
         )
+        list_serializer_class = TimedListSerializer
 
 
 class SubscriptionOfUserSerializer(CustomUserSerializer):
@@ -311,22 +469,26 @@ class SubscriptionOfUserSerializer(CustomUserSerializer):
             'recipes',
             'recipes_count'
         )
+        list_serializer_class = TimedListSerializer
 
     def get_recipes(self, obj):
-        '''Отображение рецепта в подписках.'''
-        request = self.context['request']
-        recipes_limit = request.GET.get('recipes_limit')
-        if recipes_limit:
-            recipes = obj.recipes.all()[:int(recipes_limit)]
+        '''
+        Отображение рецепта в подписках.
+        Рецепты, ограниченные recipes_limit, могут быть заранее загружены
+        для всей страницы авторов в атрибут limited_recipes.
+        '''
+        if hasattr(obj, 'limited_recipes'):
+            recipes = obj.limited_recipes
         else:
-            recipes = obj.recipes.all()
+            recipes_limit = self.context.get('recipes_limit')
+            recipes = obj.recipes.all()[:recipes_limit]
         serializer = ShortlistRecipesSerializer(
             recipes, many=True, read_only=True)
         return serializer.data
 
     def get_recipes_count(self, obj):
-        '''Кол-во подписок.'''
-        return obj.recipes.count()
+        '''Кол-во рецептов автора.'''
+        return obj.recipes_count
 
 
 class SubscriptionSerializer(serializers.ModelSerializer):
@@ -380,3 +542,34 @@ class CartSerializer(serializers.ModelSerializer):
                 message='Вы уже добавляли это рецепт в список покупок'
             )
         ]
+
+
+class BatchSerializer(serializers.Serializer):
+    '''
+    Сериализатор пакетного изменения связей: списки id для добавления
+    и удаления и флаг clear для удаления всех связей перед добавлением.
+    '''
+    add = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        default=list,
+        max_length=settings.BATCH_MAX_SIZE
+    )
+    remove = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        default=list,
+        max_length=settings.BATCH_MAX_SIZE
+    )
+    clear = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        data['add'] = list(dict.fromkeys(data['add']))
+        data['remove'] = list(dict.fromkeys(data['remove']))
+        if set(data['add']) & set(data['remove']):
+            raise serializers.ValidationError(
+                'Один id не может быть одновременно в add и remove.'
+            )
+        if data['clear'] and data['remove']:
+            raise serializers.ValidationError(
+                'С clear список remove не нужен.'
+            )
+        return data
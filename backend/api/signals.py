@@ -0,0 +1,117 @@
+from django.db.models.signals import (m2m_changed, post_delete, post_init,
+                                      post_save)
+from django.dispatch import receiver
+from recipes.models import (Cart, FavoriteRecipe, Ingredient,
+                            IngredientsAmount, Recipe, Tag)
+from recipes.signals import user_recipe_changed
+from rest_framework.authtoken.models import Token
+from users.models import Subscription, User
+
+from .authentication import invalidate_token
+from .cache import (INGREDIENTS_VERSION, RECIPES_VERSION, TAGS_VERSION,
+                    bump_version_on_commit)
+from .pagination import invalidate_counts, invalidate_user_counts
+from .personalization import invalidate_user_marks
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredients(**kwargs):
+    bump_version_on_commit(INGREDIENTS_VERSION)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags(**kwargs):
+    bump_version_on_commit(TAGS_VERSION)
+
+
+def invalidate_recipes():
+    '''
+    Сбрасывает кэш ленты рецептов после фиксации транзакции,
+    чтобы в кэш не попали данные до изменения.
+    '''
+    bump_version_on_commit(RECIPES_VERSION)
+    invalidate_counts()
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=IngredientsAmount)
+def recipe_changed(**kwargs):
+    invalidate_recipes()
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(action, **kwargs):
+    if action.startswith('post_'):
+        invalidate_recipes()
+
+
+@receiver((post_save, post_delete), sender=FavoriteRecipe)
+@receiver((post_save, post_delete), sender=Cart)
+@receiver((post_save, post_delete), sender=Subscription)
+def user_marks_changed(instance, **kwargs):
+    invalidate_user_marks(instance.user_id)
+    invalidate_user_counts(instance.user_id)
+
+
+@receiver(user_recipe_changed)
+def user_recipes_changed(user_id, **kwargs):
+    invalidate_user_marks(user_id)
+    invalidate_user_counts(user_id)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+# Поля автора, которые показываются в ленте рецептов.
+FEED_USER_FIELDS = ('username', 'first_name', 'last_name', 'email')
+
+
+def get_feed_values(user):
+    # Только загруженные значения: обращение к отложенному полю
+    # выполнило бы запрос к базе данных.
+    return {name: user.__dict__.get(name) for name in FEED_USER_FIELDS}
+
+
+@receiver(post_init, sender=User)
+def user_loaded(instance, **kwargs):
+    instance._feed_values = get_feed_values(instance)
+
+
+def feed_fields_changed(user, created, update_fields):
+    if created:
+        return False
+    if update_fields is not None and not set(FEED_USER_FIELDS) & set(
+        update_fields
+    ):
+        return False
+    previous = user._feed_values
+    return any(
+        previous[name] is None or previous[name] != value
+        for name, value in get_feed_values(user).items()
+    )
+
+
+@receiver(post_save, sender=User)
+def user_changed(instance, created, update_fields, **kwargs):
+    '''
+    Лента рецептов сбрасывается, только если изменились показанные в ней
+    поля автора, у которого есть рецепты. Регистрация, смена пароля
+    и вход ленту не затрагивают.
+    '''
+    if (
+        feed_fields_changed(instance, created, update_fields)
+        and instance.recipes_count > 0
+    ):
+        bump_version_on_commit(RECIPES_VERSION)
+    instance._feed_values = get_feed_values(instance)
+    for key in Token.objects.filter(user=instance).values_list(
+        'key', flat=True
+    ):
+        invalidate_token(key)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(**kwargs):
+    invalidate_counts()
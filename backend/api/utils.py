@@ -1,54 +1,229 @@
-import io
+import csv
+from hashlib import sha256
+from itertools import chain, islice
+from tempfile import SpooledTemporaryFile
 
-from django.db.models import Sum
-from django.http import FileResponse
+from django.conf import settings
+from django.db.models import Count, F, Max, Sum
+from django.http import HttpResponse, StreamingHttpResponse
+from recipes.models import Cart, IngredientsAmount
 from reportlab.lib.pagesizes import legal
 from reportlab.lib.units import inch
 from reportlab.pdfbase.pdfmetrics import registerFont
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
 
-from .serializers import IngredientsAmount
+from .cache import INGREDIENTS_VERSION, CacheNamespace, LRUCache, get_version
 
+SHOPPING_LIST_FILENAME = 'shopping_list'
+CHUNK_SIZE = 8192
+PDF_FONT_NAME = 'Helvetica'
+PDF_FONT_SIZE = 14
+PDF_LEADING = 18
+PDF_PAGE_SIZE = legal
+PDF_MARGIN = inch
+PDF_LINES_PER_PAGE = int((PDF_PAGE_SIZE[1] - 2 * PDF_MARGIN) // PDF_LEADING)
 
-def download_recipe(values):
-    '''Формирование pdf-списка покупок для скачивания.'''
+_fonts_registered = False
+
+
+def register_fonts():
+    '''
+    Регистрирует шрифты для pdf один раз на процесс.
+    Вызывается при старте приложения в ApiConfig.ready().
+    '''
+    global _fonts_registered
+    if _fonts_registered:
+        return
     registerFont(TTFont(
-        'Helvetica', 'data/fonts/Helvetica.ttf', 'Helvetica.ttf'))
-    buffer = io.BytesIO()
-    page = canvas.Canvas(buffer, pagesize=legal, bottomup=0)
-    recipe_list = page.beginText()
-    recipe_list.setTextOrigin(inch, inch)
-    recipe_list.setFont('Helvetica', 14)
-    lines = []
-    for recipe in values:
-        lines.append('===================')
-        lines.append(recipe.title)
-        lines.append('===================')
-        lines.append(f'Время приготовления: {recipe.cooking_time} минут')
-        lines.append(' ')
-        ingredients_cart = (
-            IngredientsAmount.objects.filter(recipe=recipe).values(
-                'ingredient__title',
-                'ingredient__measure_unit',
-            ).order_by(
-                'ingredient__title'
-            ).annotate(ingredient_amount=Sum('amount'))
+        PDF_FONT_NAME, settings.PDF_FONT_PATH, 'Helvetica.ttf'))
+    _fonts_registered = True
+
+
+def get_shopping_list(user):
+    '''
+    Список покупок пользователя.
+    Ингредиенты всех рецептов из корзины суммируются одним запросом
+    с группировкой по ингредиенту и единице измерения.
+    '''
+    ingredients = IngredientsAmount.objects.filter(
+        recipe__recipe_in_cart__user=user
+    ).values(
+        'ingredient',
+        name=F('ingredient__title'),
+        measurement_unit=F('ingredient__measure_unit'),
+    ).annotate(
+        total_amount=Sum('amount')
+    ).order_by('name', 'measurement_unit')
+    return [
+        {
+            'id': ingredient['ingredient'],
+            'name': ingredient['name'],
+            'measurement_unit': ingredient['measurement_unit'],
+            'amount': ingredient['total_amount'],
+        }
+        for ingredient in ingredients
+    ]
+
+
+def get_shopping_list_lines(shopping_list):
+    '''Строки списка покупок для текстовых форматов.'''
+    for number, ingredient in enumerate(shopping_list, start=1):
+        yield (
+            f"{number}. {ingredient['name']}: "
+            f"{ingredient['amount']} "
+            f"{ingredient['measurement_unit']}."
+        )
+
+
+def get_pages(lines, lines_per_page):
+    '''Разбивает строки на страницы.'''
+    lines = iter(lines)
+    page = list(islice(lines, lines_per_page))
+    while page:
+        yield page
+        page = list(islice(lines, lines_per_page))
+
+
+def render_pdf(shopping_list):
+    '''
+    Формирование pdf-списка покупок.
+    Строки разбиваются на страницы, документ пишется во временный файл,
+    который остается в памяти только до SHOPPING_LIST_SPOOL_MAX_SIZE байт,
+    и отдается частями.
+    '''
+    register_fonts()
+    with SpooledTemporaryFile(
+        max_size=settings.SHOPPING_LIST_SPOOL_MAX_SIZE
+    ) as buffer:
+        page = canvas.Canvas(buffer, pagesize=PDF_PAGE_SIZE, bottomup=0)
+        lines = chain(
+            ('Список покупок', ' '), get_shopping_list_lines(shopping_list)
+        )
+        for lines_on_page in get_pages(lines, PDF_LINES_PER_PAGE):
+            recipe_list = page.beginText()
+            recipe_list.setTextOrigin(PDF_MARGIN, PDF_MARGIN)
+            recipe_list.setFont(PDF_FONT_NAME, PDF_FONT_SIZE, PDF_LEADING)
+            for line in lines_on_page:
+                recipe_list.textLine(line)
+            page.drawText(recipe_list)
+            page.showPage()
+        page.save()
+        buffer.seek(0)
+        yield from iter(lambda: buffer.read(CHUNK_SIZE), b'')
+
+
+class Echo:
+    '''Буфер для csv.writer, который сразу возвращает записанную строку.'''
+
+    def write(self, value):
+        return value
+
+
+def render_csv(shopping_list):
+    '''Формирование csv-списка покупок.'''
+    writer = csv.writer(Echo())
+    yield writer.writerow(
+        ('name', 'measurement_unit', 'amount')
+    ).encode()
+    for ingredient in shopping_list:
+        yield writer.writerow((
+            ingredient['name'],
+            ingredient['measurement_unit'],
+            ingredient['amount'],
+        )).encode()
+
+
+def render_txt(shopping_list):
+    '''Формирование текстового списка покупок.'''
+    for line in get_shopping_list_lines(shopping_list):
+        yield f'{line}\n'.encode()
+
+
+SHOPPING_LIST_RENDERERS = {
+    'pdf': (render_pdf, 'application/pdf'),
+    'csv': (render_csv, 'text/csv; charset=utf-8'),
+    'txt': (render_txt, 'text/plain; charset=utf-8'),
+}
+
+shopping_list_files = LRUCache(settings.SHOPPING_LIST_CACHE_MAX_SIZE)
+shopping_lists = CacheNamespace(
+    'shopping_lists', timeout=settings.SHOPPING_LIST_CACHE_TIMEOUT
+)
+
+
+def get_cart_fingerprint(user):
+    '''
+    Отпечаток состояния корзины пользователя.
+    Меняется при добавлении и удалении рецептов из корзины, при изменении
+    рецепта, его ингредиентов и справочника ингредиентов.
+    Для пустой корзины возвращает None.
+    '''
+    cart = list(
+        Cart.objects.filter(user=user).values_list(
+            'recipe_id', 'recipe__time_update'
+        ).annotate(
+            ingredients_count=Count('recipe__ingredient_to_recipe'),
+            ingredients_last=Max('recipe__ingredient_to_recipe'),
+            ingredients_amount=Sum('recipe__ingredient_to_recipe__amount'),
+        ).order_by('recipe_id')
+    )
+    if not cart:
+        return None
+    return sha256(
+        repr((get_version(INGREDIENTS_VERSION), cart)).encode()
+    ).hexdigest()
+
+
+def get_cached_shopping_list(user, fingerprint):
+    '''
+    Список покупок из кэша по отпечатку корзины.
+    Общий для JSON-списка и файлов во всех форматах.
+    '''
+    shopping_list = shopping_lists.get(fingerprint)
+    if shopping_list is None:
+        shopping_list = get_shopping_list(user)
+        shopping_lists.set(fingerprint, shopping_list)
+    return shopping_list
+
+
+def cache_chunks(key, chunks):
+    '''
+    Отдает части файла и сохраняет файл в кэш,
+    если он не больше SHOPPING_LIST_CACHE_MAX_ENTRY_SIZE.
+    '''
+    parts, size = [], 0
+    for chunk in chunks:
+        if parts is not None:
+            size += len(chunk)
+            if size > settings.SHOPPING_LIST_CACHE_MAX_ENTRY_SIZE:
+                parts = None
+            else:
+                parts.append(chunk)
+        yield chunk
+    if parts is not None:
+        shopping_list_files.set(key, b''.join(parts))
+
+
+def download_shopping_list(user, file_format, fingerprint):
+    '''
+    Список покупок в выбранном формате файла.
+    Готовые файлы кэшируются по отпечатку корзины, повторное скачивание
+    не обращается к базе данных и reportlab.
+    '''
+    render, content_type = SHOPPING_LIST_RENDERERS[file_format]
+    key = f'{file_format}:{fingerprint}'
+    content = shopping_list_files.get(key)
+    if content is not None:
+        response = HttpResponse(content, content_type=content_type)
+    else:
+        response = StreamingHttpResponse(
+            cache_chunks(
+                key, render(get_cached_shopping_list(user, fingerprint))
+            ),
+            content_type=content_type
         )
-        for number, ingredient in enumerate(ingredients_cart, start=1):
-            lines.append(
-                f"{number}. {ingredient['ingredient__title']}: "
-                f"{ingredient['ingredient_amount']} "
-                f"{ingredient['ingredient__measure_unit']}.",
-            )
-        lines.append(' ')
-        lines.append(' ')
-
-    for line in lines:
-        recipe_list.textLine(line)
-
-    page.drawText(recipe_list)
-    page.showPage()
-    page.save()
-    buffer.seek(0)
-    return FileResponse(buffer, as_attachment=True, filename='recipe_list.pdf')
+    response['Content-Disposition'] = (
+        f'attachment; filename="{SHOPPING_LIST_FILENAME}.{file_format}"'
+    )
+    return response
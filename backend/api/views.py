@@ -1,50 +1,187 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (BooleanField, Exists, OuterRef, Prefetch,
+                              Subquery, Value)
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from recipes.models import Cart, FavoriteRecipe, Ingredient, Recipe, Tag
 from rest_framework import exceptions, permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from users.models import Subscription, User
 
+from .cache import (INGREDIENTS_VERSION, RECIPES_VERSION, TAGS_VERSION,
+                    CacheNamespace, get_versions)
 from .filters import IngredientFilter, RecipeFilter
-from .pagination import CustomPagination
+from .ingredient_index import get_ingredient_index
+from .mixins import (SharedListCacheMixin, VersionedReadOnlyMixin,
+                     conditional_response)
+from .pagination import (CustomPagination, RecipePagination,
+                         SubscriptionPagination, invalidate_user_counts)
 from .permissions import IsAuthorOrReadOnlyPermission
-from .serializers import (CreateUpdateRecipesSerializer, CustomUserSerializer,
-                          IngredientSerializer, ListOfRecipesSerializer,
-                          ShortlistRecipesSerializer,
+from .personalization import (apply_user_marks, get_user_marks,
+                              invalidate_user_marks)
+from .renderers import CSVRenderer, PDFRenderer, TextRenderer
+from .serializers import (BatchSerializer, CreateUpdateRecipesSerializer,
+                          CustomUserSerializer, IngredientSerializer,
+                          ListOfRecipesSerializer, ShortlistRecipesSerializer,
                           SubscriptionOfUserSerializer, SubscriptionSerializer,
                           TagSerializer)
-from .utils import download_recipe
+from .utils import (download_shopping_list, get_cached_shopping_list,
+                    get_cart_fingerprint)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+def get_batch_results(action, ids, done, existing, done_status,
+                      failed_status):
+    '''
+    Результаты пакетного изменения по каждому id: done_status для
+    выполненных, failed_status для существующих объектов, которые
+    не изменились, и not_found для отсутствующих.
+    '''
+    results = []
+    for id in ids:
+        if id in done:
+            result = done_status
+        elif id in existing:
+            result = failed_status
+        else:
+            result = 'not_found'
+        results.append({'id': id, 'action': action, 'status': result})
+    return results
+
+
+def get_recipes_limit(request):
+    '''Ограничение кол-ва рецептов автора из параметра recipes_limit.'''
+    recipes_limit = request.query_params.get('recipes_limit')
+    if not recipes_limit:
+        return None
+    if not recipes_limit.isdigit() or int(recipes_limit) < 1:
+        raise exceptions.ValidationError(
+            {'recipes_limit': 'Должно быть целым положительным числом.'}
+        )
+    return int(recipes_limit)
+
+
+class IngredientViewSet(VersionedReadOnlyMixin, viewsets.ReadOnlyModelViewSet):
     '''Вьюсет для игредиентов.'''
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
+    version_name = INGREDIENTS_VERSION
+
+    def list(self, request, *args, **kwargs):
+        '''
+        Список ингредиентов.
+        При включенном INGREDIENT_INDEX_ENABLED отдается из индекса
+        в памяти процесса. Версия справочника читается один раз за запрос
+        и сама берется из памяти процесса, поэтому горячий запрос
+        к базе данных не обращается.
+        '''
+        if not settings.INGREDIENT_INDEX_ENABLED:
+            return super().list(request, *args, **kwargs)
+        return self.versioned_response(
+            request, lambda: self.list_from_index(request)
+        )
 
+    def list_from_index(self, request):
+        index = get_ingredient_index(self.data_version)
+        name = request.query_params.get('name')
+        if name:
+            return Response(index.search(name))
+        return Response(index.items)
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+
+class TagViewSet(VersionedReadOnlyMixin, viewsets.ReadOnlyModelViewSet):
     '''Вьюсет для тегов.'''
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    version_name = TAGS_VERSION
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
-    '''Вьюсет для рецептов.'''
+class RecipeViewSet(SharedListCacheMixin, viewsets.ModelViewSet):
+    '''
+    Вьюсет для рецептов.
+    Страницы ленты берутся из общего кэша, отметки пользователя
+    накладываются на них при ответе.
+    '''
     queryset = Recipe.objects.all()
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
-    pagination_class = CustomPagination
+    pagination_class = RecipePagination
     permission_classes = (IsAuthorOrReadOnlyPermission,)
+    list_cache = CacheNamespace(
+        'recipes', timeout=settings.RECIPE_PAGE_CACHE_TIMEOUT
+    )
+    list_versions = (RECIPES_VERSION, TAGS_VERSION, INGREDIENTS_VERSION)
+    list_cache_bypass_params = ('is_favorited', 'is_in_shopping_cart')
+    query_budgets = {
+        'list': 10,
+        'retrieve': 6,
+        'create': 15,
+        'update': 20,
+        'partial_update': 20,
+        'favorite': 4,
+        'shopping_cart': 4,
+        'favorite_batch': 6,
+        'shopping_cart_batch': 6,
+        'download_shopping_cart': 4,
+        'shopping_list': 4,
+    }
+
+    def get_queryset(self):
+        queryset = Recipe.objects.with_user_flags(self.get_flags_user())
+        if self.action in ('list', 'retrieve'):
+            return queryset.with_related()
+        return queryset
+
+    def personalize_list(self, data):
+        marks = get_user_marks(self.request.user)
+        return {
+            **data,
+            'results': [
+                apply_user_marks(recipe, marks) for recipe in data['results']
+            ],
+        }
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return ListOfRecipesSerializer
         return CreateUpdateRecipesSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        '''
+        Рецепт с поддержкой условного GET.
+        ETag учитывает время изменения рецепта, данные автора,
+        отметки текущего пользователя и версии тегов и ингредиентов.
+        Last-Modified не отдается: ответ зависит от отметок пользователя,
+        которые время изменения рецепта не отражает.
+        '''
+        instance = self.get_object()
+        author = instance.author
+        return conditional_response(
+            request,
+            lambda: Response(self.get_serializer(instance).data),
+            (
+                instance.pk,
+                instance.time_update.isoformat(),
+                request.user.pk,
+                instance.is_favorited,
+                instance.is_in_shopping_cart,
+                author.pk,
+                author.username,
+                author.first_name,
+                author.last_name,
+                author.email,
+                author.is_subscribed,
+                *get_versions(TAGS_VERSION, INGREDIENTS_VERSION),
+            ),
+            private=True,
+            no_cache=True,
+        )
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
@@ -52,44 +189,38 @@ class RecipeViewSet(viewsets.ModelViewSet):
             methods=('POST', 'DELETE'),
             permission_classes=(permissions.IsAuthenticated,))
     def favorite(self, request, pk):
-        '''Функция для добавления и удаления рецепта в/из избранные.'''
+        '''
+        Функция для добавления и удаления рецепта в/из избранные.
+        Добавление и удаление выполняются одним запросом, который
+        сам определяет ответ; существование рецепта проверяется
+        отдельным запросом только при неудаче.
+        '''
         user = self.request.user
         if request.method == 'POST':
-            favorite_recipe = FavoriteRecipe.objects.filter(
-                recipe__id=pk, user=user
-            )
-            if favorite_recipe.exists():
+            recipe = FavoriteRecipe.objects.add(user, pk)
+            if recipe is None:
+                if not Recipe.objects.filter(pk=pk).exists():
+                    return Response(
+                        {'errors': 'Рецепт не существует.'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
                 return Response(
                     {'error': 'Рецепт уже есть в избранном.'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            try:
-                recipe = Recipe.objects.get(pk=pk)
-            except Recipe.DoesNotExist:
-                return Response(
-                    {'errors': 'Рецепт не существует.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            FavoriteRecipe.objects.create(user=user, recipe=recipe)
             serializer = ShortlistRecipesSerializer(recipe)
             return Response(
                 serializer.data,
                 status=status.HTTP_201_CREATED
             )
         if request.method == 'DELETE':
-            try:
-                recipe = Recipe.objects.get(pk=pk)
-            except Recipe.DoesNotExist:
+            if FavoriteRecipe.objects.remove(user, pk):
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            if not Recipe.objects.filter(pk=pk).exists():
                 return Response(
                     {'errors': 'Рецепт не существует.'},
                     status=status.HTTP_404_NOT_FOUND
                 )
-            favorite_recipe = FavoriteRecipe.objects.filter(
-                recipe__id=pk, user=user
-            )
-            if favorite_recipe.exists():
-                favorite_recipe.delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
             return Response(
                 {'error': ('Рецепт еще не добавлен в избранное.')},
                 status=status.HTTP_400_BAD_REQUEST
@@ -105,47 +236,141 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return self.delete_from_cart(Cart, request.user, pk)
 
     def add_to_cart(self, model, user, pk):
-        if model.objects.filter(user=user, recipe__id=pk).exists():
+        recipe = model.objects.add(user, pk)
+        if recipe is None:
+            if not Recipe.objects.filter(pk=pk).exists():
+                return Response(
+                    {'errors': 'Рецепт не существует.'},
+                    status=status.HTTP_400_BAD_REQUEST)
             return Response(
                 {'errors': 'Рецепт уже в корзине.'},
                 status=status.HTTP_400_BAD_REQUEST)
-        try:
-            recipe = Recipe.objects.get(pk=pk)
-        except Recipe.DoesNotExist:
-            return Response(
-                {'errors': 'Рецепт не существует.'},
-                status=status.HTTP_400_BAD_REQUEST)
-        model.objects.create(user=user, recipe=recipe)
         serializer = ShortlistRecipesSerializer(recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=('POST',),
+            permission_classes=(permissions.IsAuthenticated,),
+            url_path='favorite/batch')
+    def favorite_batch(self, request):
+        '''Пакетное добавление и удаление рецептов в/из избранного.'''
+        return self.apply_batch(FavoriteRecipe, request)
+
+    @action(detail=False, methods=('POST',),
+            permission_classes=(permissions.IsAuthenticated,),
+            url_path='shopping_cart/batch')
+    def shopping_cart_batch(self, request):
+        '''
+        Пакетное изменение списка покупок: добавление всех рецептов
+        подборки или очистка списка (clear) одним запросом.
+        '''
+        return self.apply_batch(Cart, request)
+
+    def apply_batch(self, model, request):
+        '''
+        Изменяет связи пользователя с рецептами в одной транзакции
+        запросами на весь список id и возвращает результат по каждому id.
+        '''
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        user = request.user
+        with transaction.atomic():
+            if data['clear']:
+                removed = model.objects.remove_many(user)
+                remove = sorted(removed)
+            else:
+                remove = data['remove']
+                removed = model.objects.remove_many(user, remove)
+            added = model.objects.add_many(user, data['add'])
+        failed = (set(data['add']) - added) | (set(remove) - removed)
+        existing = set()
+        if failed:
+            existing = set(Recipe.objects.filter(
+                id__in=failed
+            ).values_list('id', flat=True))
+        return Response({'results': (
+            get_batch_results(
+                'remove', remove, removed, existing, 'removed', 'missing'
+            )
+            + get_batch_results(
+                'add', data['add'], added, existing, 'added', 'exists'
+            )
+        )})
+
     def delete_from_cart(self, model, user, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
-        cart = model.objects.filter(user=user, recipe=recipe)
-        if cart.exists():
-            cart.delete()
+        if model.objects.remove(user, pk):
             return Response(status=status.HTTP_204_NO_CONTENT)
+        get_object_or_404(Recipe, id=pk)
         return Response({'errors': 'Рецепта уже нет в вашей корзине.'},
                         status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=False, methods=('GET',),
-            permission_classes=(permissions.IsAuthenticated,))
+            permission_classes=(permissions.IsAuthenticated,),
+            renderer_classes=(PDFRenderer, CSVRenderer, TextRenderer,
+                              JSONRenderer))
     def download_shopping_cart(self, request):
-        '''Функция скачивания рецептов из списка покупок.'''
-        user_cart = request.user
-        if not user_cart.user_cart.exists():
+        '''
+        Функция скачивания списка покупок.
+        Формат выбирается параметром `?format=`: pdf (по умолчанию),
+        csv, txt или json.
+        '''
+        fingerprint = get_cart_fingerprint(request.user)
+        if fingerprint is None:
             return Response(status=status.HTTP_400_BAD_REQUEST)
-        recipes_list = Recipe.objects.filter(
-            recipe_in_cart__user=user_cart
+        file_format = request.accepted_renderer.format
+        if file_format == 'json':
+            return Response(
+                get_cached_shopping_list(request.user, fingerprint)
+            )
+        return download_shopping_list(request.user, file_format, fingerprint)
+
+    @action(detail=False, methods=('GET',),
+            permission_classes=(permissions.IsAuthenticated,))
+    def shopping_list(self, request):
+        '''
+        Список покупок для просмотра: ингредиенты всех рецептов корзины,
+        суммированные по ингредиенту и единице измерения.
+        Берется из кэша по отпечатку корзины, который служит и ETag.
+        '''
+        fingerprint = get_cart_fingerprint(request.user)
+        if fingerprint is None:
+            return Response([])
+        return conditional_response(
+            request,
+            lambda: Response(
+                get_cached_shopping_list(request.user, fingerprint)
+            ),
+            (fingerprint,),
+            private=True,
+            no_cache=True,
         )
-        response = download_recipe(recipes_list)
-        return response
 
 
 class UsersViewSet(UserViewSet):
     '''Вьюсет для пользователей.'''
     queryset = User.objects.all()
     pagination_class = CustomPagination
+    query_budgets = {
+        'list': 3,
+        'retrieve': 2,
+        'get_me': 2,
+        'get_subscriptions': 5,
+        'get_subscribe': 8,
+        'subscriptions_batch': 7,
+    }
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve'):
+            return queryset
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.annotate(
+                is_subscribed=Value(False, BooleanField())
+            )
+        return queryset.annotate(is_subscribed=Exists(
+            Subscription.objects.filter(user=user, author=OuterRef('pk'))
+        ))
 
     @action(detail=False, methods=('GET',),
             permission_classes=(permissions.IsAuthenticated,),
@@ -155,8 +380,24 @@ class UsersViewSet(UserViewSet):
         Возвращает пользователей, на которых подписан текущий пользователь.
         В выдачу добавляются рецепты.
         '''
-        authors = User.objects.filter(author__user=self.request.user)
-        paginator = CustomPagination()
+        recipes_limit = get_recipes_limit(request)
+        recipes = Recipe.objects.only(
+            'id', 'title', 'image', 'cooking_time', 'author'
+        )
+        if recipes_limit is not None:
+            recipes = recipes.filter(id__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')
+                ).values('id')[:recipes_limit]
+            ))
+        authors = User.objects.filter(
+            author__user=self.request.user
+        ).annotate(
+            is_subscribed=Value(True, BooleanField())
+        ).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+        )
+        paginator = SubscriptionPagination()
         paginated_queryset = paginator.paginate_queryset(
             queryset=authors, request=request
         )
@@ -189,7 +430,10 @@ class UsersViewSet(UserViewSet):
             serializer.save()
             author_serializer = SubscriptionOfUserSerializer(
                 author,
-                context={'request': request}
+                context={
+                    'request': request,
+                    'recipes_limit': get_recipes_limit(request)
+                }
             )
             return Response(
                 author_serializer.data, status=status.HTTP_201_CREATED
@@ -202,6 +446,54 @@ class UsersViewSet(UserViewSet):
             subscription.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=False, methods=('POST',),
+            permission_classes=(permissions.IsAuthenticated,),
+            url_path='subscriptions/batch')
+    def subscriptions_batch(self, request):
+        '''
+        Пакетная подписка и отписка от авторов в одной транзакции.
+        Подписка на себя получает статус self.
+        '''
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        user = request.user
+        with transaction.atomic():
+            subscriptions = Subscription.objects.filter(user=user)
+            if not data['clear']:
+                subscriptions = subscriptions.filter(
+                    author_id__in=data['remove']
+                )
+            removed = set(subscriptions.values_list('author_id', flat=True))
+            remove = sorted(removed) if data['clear'] else data['remove']
+            subscriptions.delete()
+            authors = set(User.objects.filter(
+                id__in=set(data['add']) | (set(remove) - removed)
+            ).values_list('id', flat=True))
+            subscribed = set(Subscription.objects.filter(
+                user=user, author_id__in=data['add']
+            ).values_list('author_id', flat=True))
+            added = (authors & set(data['add'])) - subscribed - {user.id}
+            Subscription.objects.bulk_create(
+                [Subscription(user=user, author_id=id) for id in added],
+                ignore_conflicts=True
+            )
+        if added:
+            invalidate_user_marks(user.id)
+            invalidate_user_counts(user.id)
+        results = (
+            get_batch_results(
+                'remove', remove, removed, authors, 'removed', 'missing'
+            )
+            + get_batch_results(
+                'add', data['add'], added, authors, 'added', 'exists'
+            )
+        )
+        for result in results:
+            if result['action'] == 'add' and result['id'] == user.id:
+                result['status'] = 'self'
+        return Response({'results': results})
+
     @action(detail=False, methods=['get', 'patch'], url_path='me',
             permission_classes=(permissions.IsAuthenticated,)
             )
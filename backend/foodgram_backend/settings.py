@@ -1,4 +1,5 @@
 import os
+from importlib.util import find_spec
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -31,6 +32,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -71,6 +73,40 @@ DATABASES = {
     }
 }
 
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+    'redis': 'django_redis.cache.RedisCache',
+}
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', default='locmem')
+if (
+    CACHE_BACKEND not in CACHE_BACKENDS
+    or CACHE_BACKEND == 'redis' and find_spec('django_redis') is None
+    or CACHE_BACKEND == 'memcached' and find_spec('pymemcache') is None
+):
+    CACHE_BACKEND = 'locmem'
+CACHE_LOCATIONS = {
+    'locmem': 'foodgram',
+    'file': '/tmp/foodgram_cache',
+    'memcached': '127.0.0.1:11211',
+    'redis': 'redis://127.0.0.1:6379/1',
+}
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': (
+            os.getenv('CACHE_LOCATION') or CACHE_LOCATIONS[CACHE_BACKEND]),
+        'TIMEOUT': int(os.getenv('CACHE_TIMEOUT', default=300)),
+        'KEY_PREFIX': os.getenv('CACHE_KEY_PREFIX', default='foodgram'),
+        'VERSION': int(os.getenv('CACHE_VERSION', default=1)),
+        'OPTIONS': {
+            'locmem': {'MAX_ENTRIES': 10000, 'CULL_FREQUENCY': 4},
+            'file': {'MAX_ENTRIES': 50000, 'CULL_FREQUENCY': 4},
+        }.get(CACHE_BACKEND, {}),
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -100,6 +136,8 @@ AUTH_USER_MODEL = 'users.User'
 
 CSV_DATA_ROOT = os.path.join(BASE_DIR, 'data')
 
+PDF_FONT_PATH = os.path.join(CSV_DATA_ROOT, 'fonts', 'Helvetica.ttf')
+
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'collected_static'
 
@@ -114,7 +152,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DATETIME_FORMAT': '%d.%m.%Y %H:%M:%S',
 }
@@ -134,8 +172,55 @@ DJOSER = {
     'HIDE_USERS': False,
 }
 
+API_METRICS_PREFIX = '/api/'
+QUERY_BUDGETS_STRICT = os.getenv(
+    'QUERY_BUDGETS_STRICT', default='False') == 'True'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api.instrumentation': {
+            'handlers': ['console'],
+            'level': os.getenv('API_METRICS_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+TOKEN_CACHE_TIMEOUT = 60
+RECIPE_PAGE_CACHE_TIMEOUT = 300
+USER_MARKS_CACHE_TIMEOUT = 300
+PAGINATION_COUNT_CACHE_TIMEOUT = 30
+DATA_VERSION_CACHE_TIMEOUT = 5
+PAGINATION_ESTIMATE_MIN_ROWS = 100_000
+
 PAGE_SIZE = 6
 MAX_PAGE_SIZE = 50
+BATCH_MAX_SIZE = 100
 RECIPE_NAME_MAX_LEN = 200
 INGREDIENTS_MIN_AMOUNT = 1
 COOKING_TIME_MIN = 1
+IMAGE_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+IMAGE_MAX_PIXELS = 40_000_000
+IMAGE_MAX_SIDE = (2048, 2048)
+IMAGE_FORMAT = 'JPEG'
+IMAGE_QUALITY = 85
+THUMBNAIL_SIZES = {
+    'small': (400, 400),
+    'medium': (800, 800),
+}
+THUMBNAIL_CACHE_SIZE = 10000
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', default=2))
+IMAGE_PIPELINE_SYNC = os.getenv('IMAGE_PIPELINE_SYNC', default='False') == 'True'
+INGREDIENT_INDEX_ENABLED = os.getenv(
+    'INGREDIENT_INDEX_ENABLED', default='True') == 'True'
+SHOPPING_LIST_SPOOL_MAX_SIZE = 1024 * 1024
+SHOPPING_LIST_CACHE_MAX_SIZE = 32 * 1024 * 1024
+SHOPPING_LIST_CACHE_MAX_ENTRY_SIZE = 1024 * 1024
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60
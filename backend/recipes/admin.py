@@ -24,7 +24,8 @@ class IngredientAdmin(admin.ModelAdmin):
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     '''Кофигурация Recipe в админке.'''
-    list_display = ('title', 'author', 'image',)
+    list_display = ('title', 'author', 'image', 'favorites_count',)
+    readonly_fields = ('favorites_count', 'carts_count',)
     list_filter = ('title', 'author', 'tags',)
     search_fields = ('title', 'author', 'tags',)
     inlines = (IngredientsAmountInline, )
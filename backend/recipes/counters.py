@@ -0,0 +1,34 @@
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_related(model, field):
+    '''Подзапрос с фактическим кол-вом связанных строк.'''
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+                field
+            ).annotate(total=Count('pk')).values('total'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+def reconcile_counters(recipe_model, user_model, favorite_model, cart_model):
+    '''
+    Пересчитывает денормализованные счетчики по фактическим данным.
+    Возвращает кол-во исправленных строк по каждому счетчику.
+    '''
+    counters = (
+        (recipe_model, 'favorites_count', favorite_model, 'recipe'),
+        (recipe_model, 'carts_count', cart_model, 'recipe'),
+        (user_model, 'recipes_count', recipe_model, 'author'),
+    )
+    fixed = {}
+    for model, counter, related_model, field in counters:
+        actual = count_related(related_model, field)
+        fixed[f'{model.__name__}.{counter}'] = model.objects.exclude(
+            **{counter: actual}
+        ).update(**{counter: actual})
+    return fixed
@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from recipes.models import Recipe
+from users.models import User
+
+USER_ID = 1
+
+# Проверяемый запрос и имена индексов, один из которых должен быть в плане.
+# Для ограничений уникальности SQLite создает индексы sqlite_autoindex_*.
+CHECKS = (
+    (
+        'Фильтр по избранному',
+        lambda: Recipe.objects.filter(favorite__user=USER_ID),
+        ('unique_favorite', 'sqlite_autoindex_recipes_favoriterecipe'),
+    ),
+    (
+        'Фильтр по списку покупок',
+        lambda: Recipe.objects.filter(recipe_in_cart__user=USER_ID),
+        ('unique_cart', 'sqlite_autoindex_recipes_cart'),
+    ),
+    (
+        'Отметка is_favorited в ленте',
+        lambda: Recipe.objects.with_user_flags(
+            User(pk=USER_ID)
+        )[:6],
+        ('unique_favorite', 'sqlite_autoindex_recipes_favoriterecipe'),
+    ),
+    (
+        'Отметка is_in_shopping_cart в ленте',
+        lambda: Recipe.objects.with_user_flags(
+            User(pk=USER_ID)
+        )[:6],
+        ('unique_cart', 'sqlite_autoindex_recipes_cart'),
+    ),
+    (
+        'Фильтр по тегам',
+        lambda: Recipe.objects.filter(
+            tags__slug__in=('breakfast', 'lunch')
+        ).distinct(),
+        ('recipe_tags_tag_recipe_idx',),
+    ),
+    (
+        'Фильтр по автору',
+        lambda: Recipe.objects.filter(author__id__in=(USER_ID,)),
+        ('recipe_author_feed_idx',),
+    ),
+    (
+        'Лента рецептов',
+        lambda: Recipe.objects.all()[:6],
+        ('recipe_ordering_idx',),
+    ),
+    (
+        'Лента рецептов по курсору',
+        lambda: Recipe.objects.order_by('-time_create', '-id')[:6],
+        ('recipe_feed_idx',),
+    ),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Проверка по EXPLAIN, что частые запросы API используют индексы. '
+        'Завершается ошибкой, если план запроса не использует индекс.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true')
+
+    def explain(self, queryset):
+        '''
+        План запроса. В PostgreSQL последовательное сканирование
+        отключается, чтобы на маленьких таблицах план не зависел
+        от их размера.
+        '''
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            return queryset.explain()
+
+    def handle(self, *args, **options):
+        failed = []
+        for title, get_queryset, indexes in CHECKS:
+            plan = self.explain(get_queryset())
+            if any(index in plan for index in indexes):
+                self.stdout.write(self.style.SUCCESS(f'OK    {title}'))
+            else:
+                failed.append(title)
+                self.stdout.write(self.style.ERROR(f'FAIL  {title}'))
+            if options['verbose_plans'] or title in failed:
+                self.stdout.write(plan)
+        if failed:
+            raise CommandError(
+                f'Не используют индексы запросов: {len(failed)}.'
+            )
@@ -1,5 +1,6 @@
 import csv
 
+from api.cache import INGREDIENTS_VERSION, TAGS_VERSION, bump_version
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from recipes.models import Ingredient, Tag
@@ -24,6 +25,7 @@ class Command(BaseCommand):
             ]
             Ingredient.objects.all().delete()
             Ingredient.objects.bulk_create(ingredients)
+        bump_version(INGREDIENTS_VERSION)
         print('Импорт ингредиентов из CSV завершен.')
         with open(
             f'{getattr(settings, "CSV_DATA_ROOT")}/tags.csv',
@@ -41,4 +43,5 @@ class Command(BaseCommand):
             ]
             Tag.objects.all().delete()
             Tag.objects.bulk_create(tags)
+        bump_version(TAGS_VERSION)
         print('Импорт тегов из CSV завершен.')
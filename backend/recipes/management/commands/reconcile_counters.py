@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from recipes.counters import reconcile_counters
+from recipes.models import Cart, FavoriteRecipe, Recipe
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Пересчет счетчиков избранного, корзины и рецептов автора'
+
+    def handle(self, *args, **kwargs):
+        fixed = reconcile_counters(Recipe, User, FavoriteRecipe, Cart)
+        for counter, count in fixed.items():
+            self.stdout.write(f'{counter}: исправлено строк {count}')
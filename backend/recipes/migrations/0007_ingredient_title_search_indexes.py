@@ -0,0 +1,36 @@
+from django.db import migrations
+
+CREATE_INDEXES = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_title_prefix '
+    'ON recipes_ingredient (UPPER(title) varchar_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_title_trgm '
+    'ON recipes_ingredient USING gin (UPPER(title) gin_trgm_ops)',
+)
+DROP_INDEXES = (
+    'DROP INDEX IF EXISTS recipes_ingredient_title_prefix',
+    'DROP INDEX IF EXISTS recipes_ingredient_title_trgm',
+)
+
+
+def execute_on_postgresql(statements):
+    def execute(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return execute
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_alter_recipe_cooking_time'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            execute_on_postgresql(CREATE_INDEXES),
+            execute_on_postgresql(DROP_INDEXES),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.3 on 2026-10-18 19:37
+
+from django.db import migrations, models
+from recipes.counters import reconcile_counters
+
+
+def fill_counters(apps, schema_editor):
+    reconcile_counters(
+        apps.get_model('recipes', 'Recipe'),
+        apps.get_model('users', 'User'),
+        apps.get_model('recipes', 'FavoriteRecipe'),
+        apps.get_model('recipes', 'Cart'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_ingredient_title_search_indexes'),
+        ('users', '0005_user_recipes_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.3 on 2026-10-18 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(
+                fields=['-time_create', '-id'], name='recipe_feed_idx'
+            ),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 3.2.3 on 2026-10-18 19:47
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+from recipes.counters import reconcile_counters
+
+
+def delete_duplicates(apps, schema_editor):
+    '''
+    Удаляет повторные записи избранного и корзины перед добавлением
+    ограничений уникальности и пересчитывает счетчики рецептов.
+    '''
+    for model_name in ('FavoriteRecipe', 'Cart'):
+        model = apps.get_model('recipes', model_name)
+        duplicates = model.objects.values('user', 'recipe').annotate(
+            first_id=Min('id'), total=Count('id')
+        ).filter(total__gt=1).order_by()
+        for duplicate in duplicates:
+            model.objects.filter(
+                user=duplicate['user'], recipe=duplicate['recipe']
+            ).exclude(id=duplicate['first_id']).delete()
+    reconcile_counters(
+        apps.get_model('recipes', 'Recipe'),
+        apps.get_model('users', 'User'),
+        apps.get_model('recipes', 'FavoriteRecipe'),
+        apps.get_model('recipes', 'Cart'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_feed_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(
+                fields=('user', 'recipe'), name='unique_cart'
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name='favoriterecipe',
+            constraint=models.UniqueConstraint(
+                fields=('user', 'recipe'), name='unique_favorite'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(
+                fields=['-time_create', '-time_update'],
+                name='recipe_ordering_idx'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(
+                fields=['author', '-time_create'],
+                name='recipe_author_feed_idx'
+            ),
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX recipe_tags_tag_recipe_idx '
+            'ON recipes_recipe_tags (tag_id, recipe_id)',
+            'DROP INDEX recipe_tags_tag_recipe_idx',
+        ),
+    ]
@@ -1,10 +1,230 @@
 from colorfield.fields import ColorField
 from django.core.validators import RegexValidator
-from django.db import models
-from users.models import User
+from django.db import connections, models, router, transaction
+from users.models import CountersMixin, Subscription, User
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+    '''Набор запросов рецептов.'''
+
+    def with_related(self):
+        '''Подгружает теги и ингредиенты рецептов одним запросом на связь.'''
+        return self.prefetch_related(
+            'tags',
+            models.Prefetch(
+                'ingredient_to_recipe',
+                queryset=IngredientsAmount.objects.select_related(
+                    'ingredient'
+                )
+            ),
+        )
+
+    def with_user_flags(self, user):
+        '''
+        Добавляет флаги is_favorited и is_in_shopping_cart для рецепта
+        и is_subscribed для его автора.
+        '''
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=models.Value(False, models.BooleanField()),
+                is_in_shopping_cart=models.Value(
+                    False, models.BooleanField()
+                ),
+            ).prefetch_related(models.Prefetch(
+                'author',
+                queryset=User.objects.annotate(
+                    is_subscribed=models.Value(False, models.BooleanField())
+                )
+            ))
+        return self.annotate(
+            is_favorited=models.Exists(FavoriteRecipe.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+            is_in_shopping_cart=models.Exists(Cart.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+        ).prefetch_related(models.Prefetch(
+            'author',
+            queryset=User.objects.annotate(
+                is_subscribed=models.Exists(Subscription.objects.filter(
+                    user=user, author=models.OuterRef('pk')
+                ))
+            )
+        ))
+
+
+class UserRecipeQuerySet(models.QuerySet):
+    '''
+    Набор запросов связей пользователя с рецептом.
+    Добавление и удаление связи меняют счетчик рецепта counter_field
+    модели в том же запросе. Запросы идут в обход ORM, поэтому вместо
+    post_save и post_delete отправляется сигнал user_recipe_changed.
+    '''
+
+    def execute(self, using, sql, params):
+        '''
+        Выполняет SQL с подстановкой имен таблиц, счетчика
+        и заполнителей {ids} для параметров после первого.
+        Возвращает все строки результата.
+        '''
+        connection = connections[using]
+        quote_name = connection.ops.quote_name
+        sql = sql.format(
+            relation=quote_name(self.model._meta.db_table),
+            recipe=quote_name(Recipe._meta.db_table),
+            counter=quote_name(self.model.counter_field),
+            ids=', '.join(['%s'] * (len(params) - 1)),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            if cursor.description is None:
+                return []
+            return cursor.fetchall()
+
+    def execute_one(self, using, sql, params):
+        rows = self.execute(using, sql, params)
+        return rows[0] if rows else None
+
+    def changed(self, using, user, recipe_ids, added):
+        from .signals import user_recipe_changed
+        user_recipe_changed.send(
+            sender=self.model,
+            user_id=user.pk,
+            recipe_ids=recipe_ids,
+            added=added,
+            using=using,
+        )
+
+    def add(self, user, recipe_id):
+        '''
+        Добавляет связь с рецептом через INSERT ... ON CONFLICT DO NOTHING.
+        Возвращает рецепт с полями для краткой карточки или None, если
+        связь уже есть или рецепта нет. В PostgreSQL вставка и изменение
+        счетчика выполняются одним запросом.
+        '''
+        using = router.db_for_write(self.model)
+        fields = ('id', 'title', 'cooking_time', 'image')
+        returning = ', '.join(
+            f'{{recipe}}.{connections[using].ops.quote_name(field)}'
+            for field in fields
+        )
+        insert = (
+            'INSERT INTO {relation} (user_id, recipe_id) '
+            'SELECT %s, id FROM {recipe} WHERE id = %s '
+            'ON CONFLICT (user_id, recipe_id) DO NOTHING '
+            'RETURNING recipe_id'
+        )
+        if connections[using].vendor == 'postgresql':
+            row = self.execute_one(
+                using,
+                f'WITH added AS ({insert}) '
+                'UPDATE {recipe} SET {counter} = {counter} + 1 '
+                'FROM added WHERE {recipe}.id = added.recipe_id '
+                f'RETURNING {returning}',
+                (user.pk, recipe_id)
+            )
+        else:
+            with transaction.atomic(using=using):
+                row = self.execute_one(using, insert, (user.pk, recipe_id))
+                if row is not None:
+                    row = self.execute_one(
+                        using,
+                        'UPDATE {recipe} SET {counter} = {counter} + 1 '
+                        f'WHERE id = %s RETURNING {returning}',
+                        row
+                    )
+        if row is None:
+            return None
+        self.changed(using, user, [row[0]], True)
+        return Recipe.from_db(using, fields, row)
+
+    def remove(self, user, recipe_id):
+        '''
+        Удаляет связь с рецептом через DELETE ... RETURNING.
+        Возвращает True, если связь была. В PostgreSQL удаление
+        и изменение счетчика выполняются одним запросом.
+        '''
+        using = router.db_for_write(self.model)
+        delete = (
+            'DELETE FROM {relation} WHERE user_id = %s AND recipe_id = %s '
+            'RETURNING recipe_id'
+        )
+        update = (
+            'UPDATE {recipe} SET {counter} = CASE '
+            'WHEN {counter} > 0 THEN {counter} - 1 ELSE 0 END '
+        )
+        if connections[using].vendor == 'postgresql':
+            row = self.execute_one(
+                using,
+                f'WITH removed AS ({delete}) {update}'
+                'FROM removed WHERE {recipe}.id = removed.recipe_id '
+                'RETURNING {recipe}.id',
+                (user.pk, recipe_id)
+            )
+        else:
+            with transaction.atomic(using=using):
+                row = self.execute_one(using, delete, (user.pk, recipe_id))
+                if row is not None:
+                    self.execute_one(using, f'{update}WHERE id = %s', row)
+        if row is None:
+            return False
+        self.changed(using, user, [row[0]], False)
+        return True
+
+    def add_many(self, user, recipe_ids):
+        '''
+        Добавляет связи со списком рецептов двумя запросами в транзакции:
+        вставка с ON CONFLICT DO NOTHING и изменение счетчиков.
+        Возвращает множество id добавленных рецептов.
+        '''
+        using = router.db_for_write(self.model)
+        if not recipe_ids:
+            return set()
+        counter = self.model.counter_field
+        with transaction.atomic(using=using):
+            added = {row[0] for row in self.execute(
+                using,
+                'INSERT INTO {relation} (user_id, recipe_id) '
+                'SELECT %s, id FROM {recipe} WHERE id IN ({ids}) '
+                'ON CONFLICT (user_id, recipe_id) DO NOTHING '
+                'RETURNING recipe_id',
+                (user.pk, *recipe_ids)
+            )}
+            Recipe.objects.filter(id__in=added).update(
+                **{counter: models.F(counter) + 1}
+            )
+        if added:
+            self.changed(using, user, sorted(added), True)
+        return added
+
+    def remove_many(self, user, recipe_ids=None):
+        '''
+        Удаляет связи со списком рецептов, без списка — все связи
+        пользователя. Выполняется двумя запросами в транзакции: удаление
+        и изменение счетчиков. Возвращает множество id удаленных рецептов.
+        '''
+        using = router.db_for_write(self.model)
+        if recipe_ids is not None and not recipe_ids:
+            return set()
+        sql = 'DELETE FROM {relation} WHERE user_id = %s '
+        if recipe_ids is None:
+            recipe_ids = ()
+        else:
+            sql += 'AND recipe_id IN ({ids}) '
+        counter = self.model.counter_field
+        with transaction.atomic(using=using):
+            removed = {row[0] for row in self.execute(
+                using, sql + 'RETURNING recipe_id', (user.pk, *recipe_ids)
+            )}
+            Recipe.objects.filter(
+                id__in=removed, **{f'{counter}__gt': 0}
+            ).update(**{counter: models.F(counter) - 1})
+        if removed:
+            self.changed(using, user, sorted(removed), False)
+        return removed
+
+
+class Recipe(CountersMixin, models.Model):
     '''Модель рецепта.'''
     title = models.CharField(
         max_length=200,
@@ -42,9 +262,35 @@ class Recipe(models.Model):
         verbose_name='Тег'
     )
     image = models.ImageField(upload_to='recipes/%Y/%m/%d/')
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном'
+    )
+    carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок'
+    )
+
+    objects = RecipeQuerySet.as_manager()
+    counter_fields = ('favorites_count', 'carts_count')
 
     class Meta:
         ordering = ('-time_create', '-time_update')
+        indexes = (
+            models.Index(
+                fields=('-time_create', '-id'), name='recipe_feed_idx'
+            ),
+            models.Index(
+                fields=('-time_create', '-time_update'),
+                name='recipe_ordering_idx'
+            ),
+            models.Index(
+                fields=('author', '-time_create'),
+                name='recipe_author_feed_idx'
+            ),
+        )
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
@@ -143,8 +389,16 @@ class FavoriteRecipe(models.Model):
         verbose_name='Избранное'
     )
 
+    objects = UserRecipeQuerySet.as_manager()
+    counter_field = 'favorites_count'
+
     class Meta:
         verbose_name = 'Избранное'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'), name='unique_favorite'
+            ),
+        )
 
     def __str__(self) -> str:
         return f'{self.user} {self.recipe}'
@@ -165,10 +419,41 @@ class Cart(models.Model):
         verbose_name='Рецепт'
     )
 
+    objects = UserRecipeQuerySet.as_manager()
+    counter_field = 'carts_count'
+
     class Meta:
         ordering = ('id',)
         verbose_name = 'Корзина'
         verbose_name_plural = 'Корзина'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'), name='unique_cart'
+            ),
+        )
 
     def __str__(self) -> str:
         return f'{self.user} {self.recipe}'
+
+
+class DataVersion(models.Model):
+    '''
+    Версия справочника, общая для всех процессов.
+    Хранится в базе данных, чтобы изменения из других процессов,
+    например manage.py import_data, были видны и без общего кэша.
+    '''
+    name = models.CharField(
+        max_length=50,
+        primary_key=True,
+        verbose_name='Набор данных'
+    )
+    version = models.BigIntegerField(
+        verbose_name='Версия'
+    )
+
+    class Meta:
+        verbose_name = 'Версия данных'
+        verbose_name_plural = 'Версии данных'
+
+    def __str__(self) -> str:
+        return f'{self.name} {self.version}'
@@ -0,0 +1,52 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+from users.models import User
+
+from .models import Cart, FavoriteRecipe, Recipe
+
+# Связь пользователя с рецептом добавлена или удалена запросом
+# UserRecipeQuerySet в обход ORM, счетчик рецепта уже изменен.
+# Аргументы: user_id, recipe_ids, added, using.
+user_recipe_changed = Signal()
+
+
+def change_counter(model, pk, field, delta):
+    '''Атомарно меняет счетчик одним UPDATE без чтения строки.'''
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+def favorite_created(instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'favorites_count', 1)
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+def favorite_deleted(instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, 'favorites_count', -1)
+
+
+@receiver(post_save, sender=Cart)
+def cart_created(instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'carts_count', 1)
+
+
+@receiver(post_delete, sender=Cart)
+def cart_deleted(instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, 'carts_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(instance, created, **kwargs):
+    if created:
+        change_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    change_counter(User, instance.author_id, 'recipes_count', -1)
@@ -4,7 +4,30 @@ from django.core.validators import RegexValidator
 from django.db import models
 
 
-class User(AbstractUser):
+class CountersMixin:
+    '''
+    Модель с денормализованными счетчиками.
+    Счетчики меняются только атомарным UPDATE с F(), поэтому save()
+    существующего объекта их не перезаписывает. Отложенные поля, как и
+    в обычном save(), не сохраняются и не загружаются.
+    '''
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding
+                and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(CountersMixin, AbstractUser):
     '''Модель пользователя.'''
     username = models.CharField(
         max_length=150,
@@ -33,8 +56,14 @@ class User(AbstractUser):
         null=False,
         verbose_name='Адрес электронной почты'
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Кол-во рецептов'
+    )
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
+    counter_fields = ('recipes_count',)
 
     class Meta:
         ordering = ('username',)